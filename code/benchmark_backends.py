@@ -0,0 +1,72 @@
+import os
+import json
+import time
+
+import torch
+
+from helpers.load_model import CPU_BACKENDS, load_model, model_size_bytes
+from run_inference import load_eval_entries
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+
+
+@torch.no_grad()
+def benchmark_backends(
+    model_path: str,
+    prompts: list[str],
+    backends: list[str] = None,
+    new_tokens: int = 20,
+) -> dict:
+    """
+    Load the model with every CPU backend of `load_model` and report its weight
+    memory, load time and greedy decoding speed. Every prompt is generated
+    separately for exactly `new_tokens` tokens, so all backends do the same work.
+    """
+    results = {}
+    for backend in backends or list(CPU_BACKENDS):
+        start = time.perf_counter()
+        model, tokenizer = load_model(model_path, backend)
+        load_seconds = time.perf_counter() - start
+
+        generated = 0
+        start = time.perf_counter()
+        for prompt in prompts:
+            inputs = tokenizer(prompt, return_tensors="pt", truncation=True)
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=new_tokens,
+                min_new_tokens=new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+            generated += outputs.shape[1] - inputs["input_ids"].shape[1]
+        seconds = time.perf_counter() - start
+
+        results[backend] = {
+            "memory_gb": model_size_bytes(model) / 1e9,
+            "load_seconds": load_seconds,
+            "tokens_per_second": generated / seconds,
+        }
+        print(
+            f"{backend}: {results[backend]['memory_gb']:.2f} GB, "
+            f"{results[backend]['tokens_per_second']:.2f} tokens/s"
+        )
+        del model
+    return results
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(
+        current_path, "..", "data", "evaluation", "evaluation.jsonl"
+    )
+    model_path = os.path.join(current_path, "..", "models", "starcoder_3b_local")
+    output_path = os.path.join(
+        current_path, "..", "data", "evaluation", "backend_benchmark.json"
+    )
+
+    prompts = [prompt for prompt, _ in load_eval_entries(input_path, subset_size=16)]
+    results = benchmark_backends(model_path, prompts)
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark saved to {output_path}")
@@ -1,7 +1,9 @@
 import json
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
 import os
 
+from helpers.bleu import ScoreSummary, score_predictions, score_rows, sentence_bleu
+from helpers.convert_data import prompt_id
+
 current_path = os.path.dirname(os.path.abspath(__file__))
 
 
@@ -10,36 +12,72 @@ def load_json(file_path):
         return json.load(f)
 
 
+class PredictionFile:
+    """
+    Prediction file opened for joins by snippet id. Only an id -> byte offset
+    index is kept in memory; rows are read back on demand. Rows without an "id"
+    (older outputs) are keyed by the hash of their "input". Legacy JSON arrays
+    cannot be indexed and are loaded whole.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = {}
+        self.rows = None
+        self._file = open(path, "rb")
+        if self._file.read(1).lstrip() == b"[":
+            self._file.seek(0)
+            self.rows = {row_id(row): row for row in json.load(self._file)}
+            return
+
+        self._file.seek(0)
+        offset = 0
+        for line in self._file:
+            if line.strip():
+                self.offsets[row_id(json.loads(line))] = offset
+            offset += len(line)
+
+    def __iter__(self):
+        if self.rows is not None:
+            yield from self.rows.values()
+            return
+        for offset in self.offsets.values():
+            yield self.get_at(offset)
+
+    def get_at(self, offset: int) -> dict:
+        self._file.seek(offset)
+        return json.loads(self._file.readline())
+
+    def get(self, snippet_id: str) -> dict:
+        if self.rows is not None:
+            return self.rows.get(snippet_id)
+        offset = self.offsets.get(snippet_id)
+        return None if offset is None else self.get_at(offset)
+
+    def close(self):
+        self._file.close()
+
+
+def row_id(row: dict) -> str:
+    return row.get("id") or prompt_id(row["input"])
+
+
 def compute_metrics(prediction, target):
     # exact match
     exact_match = prediction == target
 
-    target = [target.split()]
-    prediction = prediction.split()
-
-    bleu = sentence_bleu(
-        target,
-        prediction,
-        weights=(0.5, 0.5, 0, 0),
-        smoothing_function=SmoothingFunction().method1,
-    )
+    # same scores as NLTK sentence_bleu with bigram weights and method1 smoothing
+    bleu = sentence_bleu(prediction, target)
 
     return exact_match, bleu
 
 
-def evaluate_predictions(baseline_data, finetuned_data):
+def evaluate_predictions(baseline_data, finetuned_data, workers: int = None):
     if len(baseline_data) != len(finetuned_data):
         raise ValueError(
             "Baseline and finetuned JSONs don't have the same number of entries"
         )
 
-    results = []
-    baseline_exact_matches = 0
-    baseline_bleu_sum = 0
-    finetuned_exact_matches = 0
-    finetuned_bleu_sum = 0
-    total = len(baseline_data)
-
     for baseline, finetuned in zip(baseline_data, finetuned_data):
         if (
             baseline["input"] != finetuned["input"]
@@ -49,17 +87,20 @@ def evaluate_predictions(baseline_data, finetuned_data):
                 "Mismatched prompts or targets between baseline and finetuned"
             )
 
-        baseline_exact, baseline_bleu = compute_metrics(
-            baseline["output"], baseline["target"]
-        )
-        finetuned_exact, finetuned_bleu = compute_metrics(
-            finetuned["output"], finetuned["target"]
-        )
+    total = len(baseline_data)
+    metrics, summary = score_predictions(
+        [row["target"] for row in baseline_data],
+        {
+            "baseline": [row["output"] for row in baseline_data],
+            "finetuned": [row["output"] for row in finetuned_data],
+        },
+        workers=workers,
+    )
 
-        baseline_exact_matches += int(baseline_exact)
-        baseline_bleu_sum += baseline_bleu
-        finetuned_exact_matches += int(finetuned_exact)
-        finetuned_bleu_sum += finetuned_bleu
+    results = []
+    for i, (baseline, finetuned) in enumerate(zip(baseline_data, finetuned_data)):
+        baseline_exact, baseline_bleu = metrics["baseline"][i]
+        finetuned_exact, finetuned_bleu = metrics["finetuned"][i]
 
         result = {
             "input": baseline["input"],
@@ -74,36 +115,125 @@ def evaluate_predictions(baseline_data, finetuned_data):
         results.append(result)
 
     # summary stats
-    baseline_accuracy = baseline_exact_matches / total
-    baseline_avg_bleu = baseline_bleu_sum / total
-    finetuned_accuracy = finetuned_exact_matches / total
-    finetuned_avg_bleu = finetuned_bleu_sum / total
+    baseline_exact_matches = sum(exact for exact, _ in metrics["baseline"])
+    finetuned_exact_matches = sum(exact for exact, _ in metrics["finetuned"])
+    baseline_accuracy = summary["baseline"]["accuracy"]
+    baseline_avg_bleu = summary["baseline"]["avg_bleu"]
+    finetuned_accuracy = summary["finetuned"]["accuracy"]
+    finetuned_avg_bleu = summary["finetuned"]["avg_bleu"]
 
     scores = {
         "baseline_accuracy": baseline_accuracy,
         "baseline_avg_bleu": baseline_avg_bleu,
+        "baseline_corpus_bleu": summary["baseline"]["corpus_bleu"],
         "finetuned_accuracy": finetuned_accuracy,
         "finetuned_avg_bleu": finetuned_avg_bleu,
+        "finetuned_corpus_bleu": summary["finetuned"]["corpus_bleu"],
     }
 
     print(
         f"Baseline Exact Match Accuracy: {baseline_accuracy:.2%} ({baseline_exact_matches}/{total})"
     )
     print(f"Baseline Average BLEU Score: {baseline_avg_bleu:.4f}")
+    print(f"Baseline Corpus BLEU Score: {scores['baseline_corpus_bleu']:.4f}")
     print(
         f"Finetuned Exact Match Accuracy: {finetuned_accuracy:.2%} ({finetuned_exact_matches}/{total})"
     )
     print(f"Finetuned Average BLEU Score: {finetuned_avg_bleu:.4f}")
+    print(f"Finetuned Corpus BLEU Score: {scores['finetuned_corpus_bleu']:.4f}")
 
     return results, scores
 
 
+def write_comparison_rows(batch: list[tuple], summary: ScoreSummary, f_out):
+    """
+    Score a batch of `(snippet_id, input, target, {model: prediction})` rows, add
+    them to `summary` and write them to `f_out` in the comparison JSONL format.
+    """
+    scored = score_rows(
+        [(target, predictions) for _, _, target, predictions in batch],
+        summary.weights,
+        summary.epsilon,
+    )
+    summary.add_rows(scored)
+    for (snippet_id, input_text, target, predictions), row in zip(batch, scored):
+        result = {"id": snippet_id, "input": input_text, "target": target}
+        for name, (exact, bleu, _) in row.items():
+            result[f"{name}_prediction"] = predictions[name]
+            result[f"{name}_exact_match"] = exact
+            result[f"{name}_bleu_score"] = bleu
+        f_out.write(json.dumps(result) + "\n")
+
+
+def compare_predictions(
+    prediction_files: dict[str, str],
+    comparison_file: str,
+    batch_size: int = 1024,
+) -> dict:
+    """
+    Compare any number of prediction files (model name -> path) row by row.
+    Rows are joined by snippet id, the comparison is written to
+    `comparison_file` (JSONL) batch by batch and summary stats are accumulated
+    on the fly, so memory does not grow with the number of rows. Snippets missing
+    from any file are skipped and counted.
+    """
+    names = list(prediction_files)
+    files = {name: PredictionFile(path) for name, path in prediction_files.items()}
+    summary = ScoreSummary(names)
+    missing = 0
+
+    os.makedirs(os.path.dirname(comparison_file) or ".", exist_ok=True)
+    with open(comparison_file, "w", encoding="utf-8") as f_out:
+        batch = []
+        for first in files[names[0]]:
+            snippet_id = row_id(first)
+            rows = {names[0]: first}
+            for name in names[1:]:
+                rows[name] = files[name].get(snippet_id)
+            if any(row is None for row in rows.values()):
+                missing += 1
+                continue
+            if any(row["target"] != first["target"] for row in rows.values()):
+                raise ValueError(f"Mismatched targets for snippet {snippet_id}")
+
+            predictions = {name: row["output"] for name, row in rows.items()}
+            batch.append((snippet_id, first["input"], first["target"], predictions))
+            if len(batch) == batch_size:
+                write_comparison_rows(batch, summary, f_out)
+                batch = []
+        if batch:
+            write_comparison_rows(batch, summary, f_out)
+
+    for f in files.values():
+        f.close()
+
+    return summary_scores(summary, missing)
+
+
+def summary_scores(summary: ScoreSummary, missing: int = 0) -> dict:
+    """Flat `<model>_accuracy/_avg_bleu/_corpus_bleu` scores, printed per model."""
+    scores = {"total": summary.total, "missing": missing}
+    for name, stats in summary.summary().items():
+        scores[f"{name}_accuracy"] = stats["accuracy"]
+        scores[f"{name}_avg_bleu"] = stats["avg_bleu"]
+        scores[f"{name}_corpus_bleu"] = stats["corpus_bleu"]
+        print(
+            f"{name}: Exact Match {stats['accuracy']:.2%} "
+            f"({stats['exact_matches']}/{summary.total}), "
+            f"Average BLEU {stats['avg_bleu']:.4f}, "
+            f"Corpus BLEU {stats['corpus_bleu']:.4f}"
+        )
+    if missing:
+        print(f"Skipped {missing} snippets missing from at least one file")
+    return scores
+
+
 if __name__ == "__main__":
     baseline_json = os.path.join(
-        current_path, "..", "data", "evaluation", "baseline_predictions.json"
+        current_path, "..", "data", "evaluation", "baseline_predictions.jsonl"
     )
     finetuned_json = os.path.join(
-        current_path, "..", "data", "evaluation", "finetuned_predictions.json"
+        current_path, "..", "data", "evaluation", "finetuned_predictions.jsonl"
     )
     comparison_file = os.path.join(
         current_path, "..", "data", "evaluation", "comparison.jsonl"
@@ -112,16 +242,10 @@ if __name__ == "__main__":
         current_path, "..", "data", "evaluation", "comparison_summary.json"
     )
 
-    baseline_data = load_json(baseline_json)
-    finetuned_data = load_json(finetuned_json)
-
-    results, scores = evaluate_predictions(baseline_data, finetuned_data)
-
-    # save results
-    os.makedirs(os.path.dirname(comparison_file), exist_ok=True)
-    with open(comparison_file, "w", encoding="utf-8") as f:
-        for result in results:
-            f.write(json.dumps(result) + "\n")
+    # add more adapters/checkpoints here to compare them in the same pass
+    scores = compare_predictions(
+        {"baseline": baseline_json, "finetuned": finetuned_json}, comparison_file
+    )
 
     with open(scores_file, "w", encoding="utf-8") as f:
         json.dump(scores, f, indent=2)
@@ -0,0 +1,89 @@
+import os
+import json
+
+from peft import PeftModel
+from transformers import AutoTokenizer
+
+from helpers.bleu import ScoreSummary
+from helpers.convert_data import prompt_id
+from helpers.load_model import load_model
+from helpers.paired_inference import iter_paired_completions
+from evaluate import summary_scores, write_comparison_rows
+from run_inference import load_eval_entries, load_token_entries
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def evaluate_paired(
+    inputs_path: str,
+    comparison_file: str,
+    model: PeftModel,
+    tokenizer: AutoTokenizer,
+    separator: str = "__###__",
+    subset_size: int = None,
+    seed: int = 42,
+    batch_size: int = 1,
+    token_budget: int = None,
+    token_dataset: str = None,
+    write_batch_size: int = 1024,
+) -> dict:
+    """
+    Baseline and finetuned predictions from one base model with a LoRA adapter.
+    Every prompt is tokenized once and completed with and without the adapter
+    (see `iter_paired_completions`); results are scored and written straight to
+    `comparison_file` in the `compare_predictions` format, so no separate
+    prediction files or join step are needed.
+    """
+    prompt_ids = None
+    if token_dataset:
+        entries, prompt_ids = load_token_entries(
+            token_dataset, tokenizer, subset_size, seed
+        )
+    else:
+        entries = load_eval_entries(inputs_path, separator, subset_size, seed)
+        prompt_ids = tokenizer(
+            [input_text for input_text, _ in entries], truncation=True
+        )["input_ids"]
+
+    summary = ScoreSummary(["baseline", "finetuned"])
+    os.makedirs(os.path.dirname(comparison_file) or ".", exist_ok=True)
+    with open(comparison_file, "w", encoding="utf-8") as f_out:
+        batch = []
+        for i, baseline, finetuned in iter_paired_completions(
+            model, tokenizer, prompt_ids, batch_size, token_budget
+        ):
+            input_text, target = entries[i]
+            predictions = {"baseline": baseline, "finetuned": finetuned}
+            batch.append((prompt_id(input_text), input_text, target, predictions))
+            if len(batch) == write_batch_size:
+                write_comparison_rows(batch, summary, f_out)
+                batch = []
+        if batch:
+            write_comparison_rows(batch, summary, f_out)
+
+    return summary_scores(summary)
+
+
+if __name__ == "__main__":
+    input_path = os.path.join(
+        current_path, "..", "data", "evaluation", "evaluation.jsonl"
+    )
+    model_path = os.path.join(current_path, "..", "models", "starcoder_3b_local")
+    adapter_path = os.path.join(current_path, "..", "models", "finetuned_model")
+    comparison_file = os.path.join(
+        current_path, "..", "data", "evaluation", "comparison.jsonl"
+    )
+    scores_file = os.path.join(
+        current_path, "..", "data", "evaluation", "comparison_summary.json"
+    )
+
+    model, tokenizer = load_model(model_path)
+    model = PeftModel.from_pretrained(model, adapter_path)
+    print("Adapter loaded!")
+
+    scores = evaluate_paired(input_path, comparison_file, model, tokenizer)
+
+    with open(scores_file, "w", encoding="utf-8") as f:
+        json.dump(scores, f, indent=2)
+
+    print(f"Comparison saved!")
@@ -0,0 +1,15 @@
+import os
+
+from helpers.load_model import load_model
+from helpers.adapters import merge_adapter
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+
+
+if __name__ == "__main__":
+    model_path = os.path.join(current_path, "..", "models", "starcoder_3b_local")
+    adapter_path = os.path.join(current_path, "..", "models", "finetuned_model")
+    output_dir = os.path.join(current_path, "..", "models", "finetuned_merged")
+
+    model, tokenizer = load_model(model_path)
+    merge_adapter(model, tokenizer, adapter_path, output_dir)
@@ -5,10 +5,44 @@ from datasets import load_dataset
 from peft import LoraConfig, get_peft_model
 import psutil
 
+from helpers.convert_data import jsonl_files
+from helpers.dedup import deduplicate_jsonl
+from helpers.memory_planner import plan_training
+from helpers.packing import CausalLMCollator, pack_sequences, tokenize_with_loss_mask
+from helpers.token_dataset import TokenDataset, TokenTrainingDataset
+
 current_path = os.path.dirname(os.path.abspath(__file__))
 
 
-def finetune(model_path: str):
+def finetune(
+    model_path: str,
+    max_length: int = 256,
+    packing: bool = True,
+    mask_prompt: bool = False,
+    token_dataset: str = None,
+    train_file: str = "../data/training/train.jsonl",
+    max_samples: int = 500,
+    seed: int = 42,
+    memory_budget_gb: float = None,
+    effective_batch_size: int = 4,
+    low_memory: bool = True,
+):
+    """
+    LoRA-finetune the model at `model_path` on the training JSONL (or its
+    `JsonlSnippetWriter` shards).
+    With `packing`, tokenized examples are concatenated with EOS separators into
+    `max_length` blocks instead of padding each row; labels are built by the
+    collator, which ignores padding and, with `mask_prompt`, the prompt tokens.
+    With `token_dataset` (a prefix written by `build_token_dataset`), token ids are
+    read from the memory-mapped file instead of loading and tokenizing the JSONL.
+    At most `max_samples` rows of `train_file` (or samples of `token_dataset`) are
+    used, drawn at random with `seed` (run `deduplicate_jsonl` first so they are
+    not near-duplicates).
+    Batch size, sequence length (at most `max_length`) and gradient accumulation
+    are picked by `plan_training` to fit `memory_budget_gb` (default: available
+    RAM). With `low_memory`, gradient checkpointing and bf16 autocast are on and
+    checkpoints hold only the adapter weights, without optimizer states.
+    """
     print(f"Memory before loading: {psutil.virtual_memory().percent}% used")
 
     # load model and tokenizer
@@ -23,30 +57,10 @@ def finetune(model_path: str):
         model_path,
         torch_dtype=torch.bfloat16,
         device_map="cpu",
+        low_cpu_mem_usage=True,
     )
     print(f"Model loaded! Memory: {psutil.virtual_memory().percent}% used")
 
-    # load dataset
-    dataset = load_dataset(
-        "json", data_files="../data/training/train.jsonl", split="train"
-    )
-    print(f"Dataset loaded: {len(dataset)} examples")
-    dataset = dataset.select(range(min(500, len(dataset))))
-
-    # tokenize dataset
-    def tokenize_function(examples):
-        return tokenizer(
-            examples["text"], padding=True, truncation=True, max_length=256
-        )
-
-    tokenized_dataset = dataset.map(
-        tokenize_function, batched=True, remove_columns=["text"]
-    )
-    tokenized_dataset = tokenized_dataset.map(
-        lambda x: {**x, "labels": x["input_ids"].copy()}
-    )
-    print(f"Dataset tokenized! Memory: {psutil.virtual_memory().percent}% used")
-
     # LORA
     lora_config = LoraConfig(
         r=16,
@@ -60,21 +74,80 @@ def finetune(model_path: str):
     model.print_trainable_parameters()
     print(f"LoRA applied! Memory: {psutil.virtual_memory().percent}% used")
 
+    plan = plan_training(
+        model, max_length, memory_budget_gb, effective_batch_size, low_memory
+    )
+    max_length = plan["max_length"]
+
+    # load dataset
+    if token_dataset:
+        tokens = TokenDataset(token_dataset, tokenizer)
+        print(f"Token dataset loaded: {len(tokens)} examples")
+        tokenized_dataset = TokenTrainingDataset(
+            tokens, max_length, packing, mask_prompt, max_samples, seed
+        )
+    else:
+        dataset = load_dataset(
+            "json", data_files=jsonl_files(train_file), split="train"
+        )
+        print(f"Dataset loaded: {len(dataset)} examples")
+        dataset = dataset.shuffle(seed=seed)
+        dataset = dataset.select(range(min(max_samples, len(dataset))))
+
+        # tokenize dataset
+        tokenized_dataset = dataset.map(
+            tokenize_with_loss_mask,
+            batched=True,
+            remove_columns=["text"],
+            fn_kwargs={
+                "tokenizer": tokenizer,
+                # packing splits long examples into blocks instead of cutting them
+                "max_length": None if packing else max_length,
+                "mask_prompt": mask_prompt,
+            },
+        )
+        if packing:
+            tokenized_dataset = tokenized_dataset.map(
+                pack_sequences,
+                batched=True,
+                fn_kwargs={
+                    "block_size": max_length,
+                    "eos_token_id": tokenizer.eos_token_id,
+                },
+            )
+    print(
+        f"Dataset tokenized! {len(tokenized_dataset)} sequences, "
+        f"Memory: {psutil.virtual_memory().percent}% used"
+    )
+
     # training
+    on_cpu = not torch.cuda.is_available()
     training_args = TrainingArguments(
         output_dir="../data/finetuned_model",
-        per_device_train_batch_size=2,
-        gradient_accumulation_steps=2,
+        per_device_train_batch_size=plan["batch_size"],
+        gradient_accumulation_steps=plan["gradient_accumulation_steps"],
         num_train_epochs=2,
         learning_rate=2e-4,
         save_steps=500,
         logging_steps=10,
+        # keep loss_mask for the collator
+        remove_unused_columns=False,
+        # needed for bf16 autocast on cpu; GPU hosts (e.g. Colab) train on the GPU
+        use_cpu=on_cpu,
+        gradient_checkpointing=low_memory,
+        gradient_checkpointing_kwargs={"use_reentrant": False},
+        # T4s have no bf16 support
+        bf16=low_memory and (on_cpu or torch.cuda.is_bf16_supported()),
+        # adapter-only checkpoints: no optimizer state copies next to the model
+        save_only_model=low_memory,
+        save_total_limit=1 if low_memory else None,
     )
 
     trainer = Trainer(
         model=model,
         args=training_args,
         train_dataset=tokenized_dataset,
+        data_collator=CausalLMCollator(tokenizer),
     )
 
     try:
@@ -94,4 +167,19 @@ def finetune(model_path: str):
 
 if __name__ == "__main__":
     model_path = os.path.join(current_path, "..", "models", "starcoder_3b_local")
-    finetune(model_path)
+    train_file = os.path.join(current_path, "..", "data", "training", "train.jsonl")
+    dedup_file = os.path.join(
+        current_path, "..", "data", "training", "train.dedup.jsonl"
+    )
+    eval_file = os.path.join(
+        current_path, "..", "data", "evaluation", "evaluation.jsonl"
+    )
+
+    try:
+        jsonl_files(eval_file)
+    except FileNotFoundError:
+        eval_file = None
+
+    # drop near-duplicate snippets and snippets overlapping the evaluation set
+    deduplicate_jsonl(train_file, dedup_file, eval_file)
+    finetune(model_path, train_file=dedup_file)
@@ -1,71 +1,95 @@
 import os
 import random
 import json
-from tqdm import tqdm
+from typing import Callable
 from helpers.create_snippets import (
-    extract_structural_snippets,
-    extract_assignment_snippets,
+    extract_python_snippets,
     extract_function_snippets_ts_full_each_line,
     extract_function_snippets_ts,
 )
-from helpers.convert_data import convert_dataset_to_jsonl
+from helpers.scan_repo import iter_repo_snippets
+from helpers.snippet_cache import SnippetCache, changed_files_from_git
+from helpers.convert_data import JsonlSnippetWriter, write_snippet_txt
 
 
 def generate_dataset(
     source_dirs: list[str],
-    output_dir: str,
+    output_file: str,
     file_types: list[str],
     filters_out: list[str] = None,
     filters_in: list[str] = None,
+    separator: str = "\n",
+    shuffle: bool = True,
+    shard_size: int = None,
+    compress: bool = False,
+    txt_dir: str = None,
+    workers: int = None,
+    seed: int = None,
+    cache_dir: str = None,
+    git_revisions: str = None,
+    extractor: Callable = extract_function_snippets_ts_full_each_line,
 ):
     """
-    Generate snippets from source code files and save them to the output directory.
+    Generate snippets from source code files and write them to a JSONL dataset.
     Args:
         source_dirs (list[str]): List of source directories containing source code files
-        output_dir (str): Output directory to save snippets
+        output_file (str): Output JSONL file (shards are named after it)
         file_types (list[str]): List of file extensions to process
         filters_out (list[str], optional): List of strings to filter out files containing these strings.
         filters_in (list[str], optional): List of strings to include files containing these strings.
+        separator (str, optional): Separator between prompt and completion.
+        shuffle (bool, optional): Shuffle all snippets before writing. If False, snippets are written while files are processed.
+        shard_size (int, optional): Number of snippets per JSONL shard.
+        compress (bool, optional): Gzip-compress the JSONL shards.
+        txt_dir (str, optional): Also write one __INPUT__/__OUTPUT__ .txt file per snippet to this directory.
+        workers (int, optional): Number of processes for reading files and extracting snippets.
+        seed (int, optional): Seed for reproducible snippet sampling and shuffling.
+        cache_dir (str, optional): Directory of the incremental snippet cache; only new or changed files are extracted.
+        git_revisions (str, optional): Git revision range (e.g. "HEAD~1..HEAD") whose changed files are the only ones re-hashed.
+        extractor (Callable, optional): Snippet extractor `(lines, file_base)`, e.g. `extract_python_snippets` for .py files.
     """
 
-    os.makedirs(output_dir, exist_ok=True)
     all_snippets = []
+    cache = None
+    if cache_dir:
+        changed_files = None
+        if git_revisions:
+            changed_files = set()
+            for source_dir in source_dirs:
+                changed_files |= changed_files_from_git(source_dir, git_revisions)
+        cache = SnippetCache(
+            cache_dir,
+            extractor,
+            params={"seed": seed},
+            changed_files=changed_files,
+        )
+    writer = JsonlSnippetWriter(output_file, separator, shard_size, compress)
 
     count_files = 0
-    for source_dir in source_dirs:
-        if not os.path.isdir(source_dir):
-            print(f"Warning: {source_dir} not found. Skipping.")
-            continue
-        for root, _, files in os.walk(source_dir):
-            for file in tqdm(files, desc=f"Processing files in {source_dir}"):
-                if (
-                    file.split(".")[-1] in file_types
-                    and (
-                        filters_out is None
-                        or all(f.lower() not in file.lower() for f in filters_out)
-                    )
-                    and (
-                        filters_in is None
-                        or any(f.lower() in file.lower() for f in filters_in)
-                    )
-                ):
-                    path = os.path.join(root, file)
-                    file_base = os.path.splitext(file)[0]
-                    with open(path, "r", encoding="utf-8") as f:
-                        lines = f.readlines()
-                    snippets = extract_function_snippets_ts_full_each_line(
-                        lines, file_base
-                    )
-                    all_snippets.extend(snippets)
-                    count_files += 1
+    for _, snippets in iter_repo_snippets(
+        source_dirs,
+        file_types,
+        extractor,
+        filters_out,
+        filters_in,
+        workers=workers,
+        seed=seed,
+        cache=cache,
+    ):
+        if shuffle or txt_dir:
+            all_snippets.extend(snippets)
+        else:
+            writer.write_all(snippets)
+        count_files += 1
 
-    random.shuffle(all_snippets)
-    for i, (file_base, prefix, target) in enumerate(all_snippets, 1):
-        with open(f"{output_dir}/{file_base}_{i:03d}.txt", "w", encoding="utf-8") as f:
-            f.write(f"__INPUT__: {prefix}\n__OUTPUT__: {target}\n")
-    print(
-        f"Generated {len(all_snippets)} snippets in {count_files} files in {output_dir}"
-    )
+    if shuffle:
+        random.Random(seed).shuffle(all_snippets)
+    if shuffle or txt_dir:
+        writer.write_all(all_snippets)
+    writer.close()
+    if txt_dir:
+        write_snippet_txt(txt_dir, all_snippets)
+    print(f"Generated {writer.count} snippets in {count_files} files in {output_file}")
 
 
 if __name__ == "__main__":
@@ -109,12 +133,14 @@ if __name__ == "__main__":
     #     "microlearning",
     # ]
 
-    output_dir = os.path.join(script_dir, "..", "data", "training", "completion")
+    output_file = os.path.join(script_dir, "..", "data", "training", "train.jsonl")
 
     generate_dataset(
-        source_dirs, output_dir, file_types=["ts", "tsx"], filters_in=filters_out
+        source_dirs,
+        output_file,
+        file_types=["ts", "tsx"],
+        filters_out=filters_out,
+        workers=os.cpu_count(),
+        seed=42,
+        cache_dir=os.path.join(script_dir, "..", "data", "cache", "training"),
     )
-
-    input_dir = output_dir
-    output_file = os.path.join(script_dir, "..", "data", "training", "train.jsonl")
-    convert_dataset_to_jsonl(input_dir, output_file)
@@ -0,0 +1,123 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from peft import PeftModel
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from helpers.completion_engine import CompletionEngine
+
+
+def merge_adapter(
+    model: AutoModelForCausalLM,
+    tokenizer: AutoTokenizer,
+    adapter_path: str,
+    output_dir: str,
+) -> AutoModelForCausalLM:
+    """
+    Fold the LoRA adapter at `adapter_path` into the base weights with
+    `merge_and_unload` and save the result as a standalone checkpoint, which
+    `load_model` can load without PEFT or extra per-layer LoRA matmuls.
+    """
+    if not os.path.exists(adapter_path):
+        raise FileNotFoundError(f"File not found: {adapter_path}")
+
+    model = PeftModel.from_pretrained(model, adapter_path)
+    model = model.merge_and_unload()
+    print("Adapter merged!")
+
+    os.makedirs(output_dir, exist_ok=True)
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    print(f"Merged model saved to {output_dir}")
+    return model
+
+
+class AdapterRegistry:
+    """
+    One base model in memory with any number of per-repo LoRA adapters loaded on
+    top of it. `complete(name, prompt)` switches to adapter `name` (loading it on
+    first use) without reloading the base weights; `name=None` runs the base
+    model. At most `max_loaded` adapters are kept, least recently used ones are
+    unloaded first. Switching and generation hold a lock, so the registry can be
+    shared between request threads.
+    """
+
+    def __init__(
+        self,
+        model: AutoModelForCausalLM,
+        tokenizer: AutoTokenizer,
+        adapters: dict[str, str] = None,
+        max_loaded: int = 8,
+        max_new_tokens: int = 20,
+    ):
+        self.base_model = model
+        self.tokenizer = tokenizer
+        self.paths = dict(adapters or {})
+        self.max_loaded = max_loaded
+        self.max_new_tokens = max_new_tokens
+        self.loaded = OrderedDict()
+        self.model = None
+        self.engine = None
+        self.lock = threading.RLock()
+
+    def register(self, name: str, adapter_path: str):
+        if not os.path.exists(adapter_path):
+            raise FileNotFoundError(f"File not found: {adapter_path}")
+        with self.lock:
+            self.paths[name] = adapter_path
+
+    def _load(self, name: str):
+        if name not in self.paths:
+            raise KeyError(f"Unknown adapter: {name}")
+        if self.model is None:
+            self.model = PeftModel.from_pretrained(
+                self.base_model, self.paths[name], adapter_name=name
+            )
+            self.engine = CompletionEngine(
+                self.model, self.tokenizer, max_new_tokens=self.max_new_tokens
+            )
+        else:
+            self.model.load_adapter(self.paths[name], adapter_name=name)
+        self.loaded[name] = True
+        print(f"Adapter {name} loaded ({len(self.loaded)} in memory)")
+
+        while len(self.loaded) > self.max_loaded:
+            evicted, _ = self.loaded.popitem(last=False)
+            self.model.delete_adapter(evicted)
+            print(f"Adapter {evicted} unloaded")
+
+    @contextmanager
+    def use(self, name: str = None):
+        """Hold the lock with adapter `name` (or the base model if None) active."""
+        with self.lock:
+            if name is None:
+                if self.model is None:
+                    if self.engine is None:
+                        self.engine = CompletionEngine(
+                            self.base_model,
+                            self.tokenizer,
+                            max_new_tokens=self.max_new_tokens,
+                        )
+                    yield self.engine
+                else:
+                    with self.model.disable_adapter():
+                        yield self.engine
+                return
+
+            if name not in self.loaded:
+                self._load(name)
+            self.loaded.move_to_end(name)
+            self.model.set_adapter(name)
+            yield self.engine
+
+    def complete(self, name: str, prompt: str) -> str:
+        with self.use(name) as engine:
+            return engine.complete(prompt)
+
+    def complete_many(
+        self, name: str, prompts: list[str], batch_size: int = 1
+    ) -> list[str]:
+        with self.use(name) as engine:
+            return engine.complete_many(prompts, batch_size)
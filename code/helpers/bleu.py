@@ -0,0 +1,183 @@
+import math
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# NLTK sentence_bleu setup used by evaluate.py: bigram BLEU with method1 smoothing
+BLEU_WEIGHTS = (0.5, 0.5, 0, 0)
+METHOD1_EPSILON = 0.1
+
+
+def ngram_counts(tokens: list[str], max_n: int) -> list[Counter]:
+    return [
+        Counter(tuple(tokens[i : i + n]) for i in range(len(tokens) - n + 1))
+        for n in range(1, max_n + 1)
+    ]
+
+
+def bleu_stats(
+    prediction_tokens: list[str], target_tokens_len: int, target_counts: list[Counter]
+) -> tuple:
+    """
+    `(hyp_len, ref_len, numerators, denominators)` of NLTK's modified n-gram
+    precision for one prediction against one (pre-counted) target.
+    """
+    numerators, denominators = [], []
+    prediction_counts = ngram_counts(prediction_tokens, len(target_counts))
+    for counts, target_ngrams in zip(prediction_counts, target_counts):
+        numerators.append(
+            sum(min(count, target_ngrams[ngram]) for ngram, count in counts.items())
+        )
+        denominators.append(max(1, sum(counts.values())))
+    return len(prediction_tokens), target_tokens_len, numerators, denominators
+
+
+def bleu_from_stats(
+    stats: tuple,
+    weights: tuple = BLEU_WEIGHTS,
+    epsilon: float = METHOD1_EPSILON,
+) -> float:
+    """
+    BLEU from (summed) `bleu_stats`, computed the same way as NLTK's
+    `corpus_bleu` with `SmoothingFunction(epsilon).method1`, so scores are
+    numerically identical.
+    """
+    hyp_len, ref_len, numerators, denominators = stats
+    if numerators[0] == 0:
+        return 0
+    if hyp_len > ref_len:
+        bp = 1
+    elif hyp_len == 0:
+        bp = 0
+    else:
+        bp = math.exp(1 - ref_len / hyp_len)
+    # zero-weight orders contribute 0 * log(p) = 0 after smoothing
+    precisions = [
+        (epsilon / den if num == 0 else num / den)
+        for num, den in zip(numerators, denominators)
+    ]
+    s = (w * math.log(p) for w, p in zip(weights, precisions) if w)
+    return bp * math.exp(math.fsum(s))
+
+
+def _max_order(weights: tuple) -> int:
+    return max(i + 1 for i, w in enumerate(weights) if w)
+
+
+def sentence_bleu(
+    prediction: str,
+    target: str,
+    weights: tuple = BLEU_WEIGHTS,
+    epsilon: float = METHOD1_EPSILON,
+) -> float:
+    target_tokens = target.split()
+    stats = bleu_stats(
+        prediction.split(),
+        len(target_tokens),
+        ngram_counts(target_tokens, _max_order(weights)),
+    )
+    return bleu_from_stats(stats, weights, epsilon)
+
+
+def score_rows(
+    batch: list[tuple[str, dict[str, str]]], weights: tuple, epsilon: float
+) -> list[dict[str, tuple]]:
+    """Score one batch of `(target, {model: prediction})` rows."""
+    max_n = _max_order(weights)
+    rows = []
+    for target, predictions in batch:
+        # count target n-grams once and reuse them for every model
+        target_tokens = target.split()
+        target_counts = ngram_counts(target_tokens, max_n)
+        row = {}
+        for name, prediction in predictions.items():
+            stats = bleu_stats(prediction.split(), len(target_tokens), target_counts)
+            row[name] = (
+                prediction == target,
+                bleu_from_stats(stats, weights, epsilon),
+                stats,
+            )
+        rows.append(row)
+    return rows
+
+
+def score_predictions(
+    targets: list[str],
+    predictions: dict[str, list[str]],
+    weights: tuple = BLEU_WEIGHTS,
+    epsilon: float = METHOD1_EPSILON,
+    batch_size: int = 2048,
+    workers: int = None,
+) -> tuple[dict[str, list[tuple[bool, float]]], dict[str, dict]]:
+    """
+    Exact match and sentence BLEU of every model's predictions against `targets`.
+    Rows are scored in batches of `batch_size`, optionally on a process pool with
+    `workers` processes. Returns per-model `(exact_match, bleu)` lists and a
+    per-model summary with accuracy, average BLEU and corpus-level BLEU.
+    """
+    names = list(predictions)
+    rows = [
+        (target, {name: predictions[name][i] for name in names})
+        for i, target in enumerate(targets)
+    ]
+    batches = [rows[i : i + batch_size] for i in range(0, len(rows), batch_size)]
+    score = partial(score_rows, weights=weights, epsilon=epsilon)
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scored = [row for batch in pool.map(score, batches) for row in batch]
+    else:
+        scored = [row for batch in map(score, batches) for row in batch]
+
+    scores = {name: [row[name][:2] for row in scored] for name in names}
+    summary = ScoreSummary(names, weights, epsilon)
+    summary.add_rows(scored)
+    return scores, summary.summary()
+
+
+class ScoreSummary:
+    """
+    Running exact-match, average BLEU and corpus BLEU totals per model, fed with
+    rows from `score_rows` so summaries can be accumulated while streaming.
+    """
+
+    def __init__(
+        self,
+        names: list[str],
+        weights: tuple = BLEU_WEIGHTS,
+        epsilon: float = METHOD1_EPSILON,
+    ):
+        self.weights = weights
+        self.epsilon = epsilon
+        max_n = _max_order(weights)
+        self.total = 0
+        self.exact = {name: 0 for name in names}
+        self.bleu_sum = {name: 0 for name in names}
+        self.corpus = {name: [0, 0, [0] * max_n, [0] * max_n] for name in names}
+
+    def add_rows(self, rows: list[dict[str, tuple]]):
+        for row in rows:
+            self.total += 1
+            for name, (exact, bleu, stats) in row.items():
+                self.exact[name] += int(exact)
+                self.bleu_sum[name] += bleu
+                corpus = self.corpus[name]
+                hyp_len, ref_len, nums, dens = stats
+                corpus[0] += hyp_len
+                corpus[1] += ref_len
+                corpus[2] = [a + b for a, b in zip(corpus[2], nums)]
+                corpus[3] = [a + b for a, b in zip(corpus[3], dens)]
+
+    def summary(self) -> dict[str, dict]:
+        """Scores per model; all 0 if no rows were added (e.g. no shared ids)."""
+        total = self.total or 1
+        return {
+            name: {
+                "exact_matches": self.exact[name],
+                "accuracy": self.exact[name] / total,
+                "avg_bleu": self.bleu_sum[name] / total,
+                "corpus_bleu": bleu_from_stats(
+                    tuple(self.corpus[name]), self.weights, self.epsilon
+                ),
+            }
+            for name in self.exact
+        }
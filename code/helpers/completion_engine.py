@@ -0,0 +1,284 @@
+import copy
+import weakref
+from threading import Thread
+from typing import Iterator
+
+import torch
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    GenerationConfig,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
+from tqdm import tqdm
+
+
+class NewlineStoppingCriteria(StoppingCriteria):
+    """
+    Stop each sequence of a batch on its own once its first non-empty line is
+    complete. Every vocabulary entry is decoded once up front, so tokens that
+    merely contain a line break (e.g. `")\n"` or `"\n\n"` merges) are caught, while
+    leading newline/indentation tokens before any code do not stop generation.
+    The decoded tables are cached per tokenizer, so building another criteria
+    (e.g. one `CompletionEngine` per `run_model` call) does not decode again.
+    """
+
+    _tables = weakref.WeakKeyDictionary()
+
+    def __init__(
+        self, tokenizer: AutoTokenizer, vocab_size: int = None, prompt_length: int = 0
+    ):
+        key = (len(tokenizer), vocab_size)
+        tables = self._tables.setdefault(tokenizer, {})
+        if key not in tables:
+            tables[key] = self._build_tables(tokenizer, vocab_size)
+        self.has_newline, self.has_content, self.ends_line = tables[key]
+        self.prompt_length = prompt_length
+
+    @staticmethod
+    def _build_tables(tokenizer: AutoTokenizer, vocab_size: int = None):
+        texts = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+        padding = [""] * max(0, (vocab_size or 0) - len(texts))
+        texts += padding
+        has_newline = torch.tensor(["\n" in t or "\r" in t for t in texts])
+        has_content = torch.tensor([t.strip() != "" for t in texts])
+        # code followed by a line break within the same token
+        ends_line = torch.tensor(
+            ["\n" in t.lstrip() or "\r" in t.lstrip() for t in texts]
+        )
+        return has_newline, has_content, ends_line
+
+    def for_prompt_length(self, prompt_length: int) -> "NewlineStoppingCriteria":
+        criteria = copy.copy(self)
+        criteria.prompt_length = prompt_length
+        return criteria
+
+    def line_complete(self, generated_ids: list[int]) -> bool:
+        """Same check as `__call__` for a single sequence of generated ids."""
+        if not generated_ids:
+            return False
+        last = generated_ids[-1]
+        seen_content = bool(self.has_content[generated_ids[:-1]].any())
+        return bool(self.ends_line[last] or (self.has_newline[last] and seen_content))
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> torch.BoolTensor:
+        generated = input_ids[:, self.prompt_length :].cpu()
+        last = generated[:, -1]
+        seen_content = self.has_content[generated[:, :-1]].any(dim=1)
+        done = self.ends_line[last] | (self.has_newline[last] & seen_content)
+        return done.to(input_ids.device)
+
+
+def make_length_buckets(
+    lengths: list[int],
+    batch_size: int = None,
+    token_budget: int = None,
+    max_length: int = 20,
+) -> list[list[int]]:
+    """
+    Group prompt indices into batches of similar length.
+    Indices are sorted by prompt length so each batch needs little padding. A batch
+    is closed when it reaches `batch_size` or when its padded size (longest prompt
+    plus `max_length` new tokens, times rows) would exceed `token_budget`.
+    """
+    if batch_size is None and token_budget is None:
+        raise ValueError("Either batch_size or token_budget must be set")
+
+    buckets = []
+    current = []
+    for idx in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # lengths are ascending, so the new prompt is the longest in the batch
+        padded_tokens = (len(current) + 1) * (lengths[idx] + max_length)
+        if current and (
+            (batch_size is not None and len(current) >= batch_size)
+            or (token_budget is not None and padded_tokens > token_budget)
+        ):
+            buckets.append(current)
+            current = []
+        current.append(idx)
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+class CompletionEngine:
+    """
+    Single-line code completion around a model/tokenizer pair from `load_model`.
+    Device, dtype, stop tokens and generation config are set up once here, so
+    `complete` and `complete_many` only tokenize, generate and decode.
+    """
+
+    def __init__(
+        self,
+        model: AutoModelForCausalLM,
+        tokenizer: AutoTokenizer,
+        device: str = None,
+        dtype: torch.dtype = None,
+        max_new_tokens: int = 20,
+    ):
+        self.device = torch.device(
+            device or ("cuda" if torch.cuda.is_available() else "cpu")
+        )
+        self.model = model.to(self.device, dtype) if dtype else model.to(self.device)
+        self.model.eval()
+
+        self.tokenizer = tokenizer
+        self.tokenizer.padding_side = "left"
+        # truncation must keep the end of the prompt, where the completion starts
+        self.tokenizer.truncation_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        self.newline_criteria = NewlineStoppingCriteria(
+            tokenizer, vocab_size=self.model.config.vocab_size
+        )
+        self.generation_config = GenerationConfig(
+            max_new_tokens=max_new_tokens,
+            num_return_sequences=1,
+            do_sample=False,
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id,
+        )
+
+    def _stopping_criteria(self, prompt_length: int) -> StoppingCriteriaList:
+        return StoppingCriteriaList(
+            [self.newline_criteria.for_prompt_length(prompt_length)]
+        )
+
+    @staticmethod
+    def first_line(text: str) -> str:
+        text = text.strip()
+        return text.split("\n")[0].strip() if text else ""
+
+    @torch.no_grad()
+    def _generate(self, prompts: list[str]) -> list[str]:
+        inputs = self.tokenizer(
+            prompts, return_tensors="pt", padding=True, truncation=True
+        )
+        return self.generate_padded(inputs)
+
+    def pad_ids(self, prompt_ids: list) -> dict:
+        """Left-padded `input_ids`/`attention_mask` tensors for token id lists."""
+        return self.tokenizer.pad(
+            {"input_ids": [[int(i) for i in ids] for ids in prompt_ids]},
+            padding=True,
+            return_tensors="pt",
+        )
+
+    def _generate_ids(self, prompt_ids: list[list[int]]) -> list[str]:
+        return self.generate_padded(self.pad_ids(prompt_ids))
+
+    @torch.no_grad()
+    def generate_padded(self, inputs) -> list[str]:
+        """
+        First-line completions of an already left-padded batch (e.g. from
+        `pad_ids`), so one padded batch can be generated several times.
+        """
+        inputs = {key: value.to(self.device) for key, value in inputs.items()}
+
+        outputs = self.model.generate(
+            **inputs,
+            generation_config=self.generation_config,
+            stopping_criteria=self._stopping_criteria(inputs["input_ids"].shape[1]),
+        )
+        # left padding: every prompt ends at the same position
+        new_tokens = outputs[:, inputs["input_ids"].shape[1] :]
+        return [
+            self.first_line(text)
+            for text in self.tokenizer.batch_decode(
+                new_tokens, skip_special_tokens=True
+            )
+        ]
+
+    def encode(self, prompts: list[str]) -> list[list[int]]:
+        return self.tokenizer(prompts, truncation=True)["input_ids"]
+
+    def complete(self, prompt: str) -> str:
+        return self._generate([prompt])[0]
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Yield the completion of `prompt` piece by piece while it is generated,
+        up to (not including) the line break ending the first non-empty line.
+        """
+        inputs = self.tokenizer(prompt, return_tensors="pt", truncation=True)
+        inputs = {key: value.to(self.device) for key, value in inputs.items()}
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+        thread = Thread(
+            target=torch.no_grad()(self.model.generate),
+            kwargs={
+                **inputs,
+                "generation_config": self.generation_config,
+                "stopping_criteria": self._stopping_criteria(
+                    inputs["input_ids"].shape[1]
+                ),
+                "streamer": streamer,
+            },
+        )
+        thread.start()
+        seen_content = False
+        try:
+            for text in streamer:
+                if not seen_content:
+                    text = text.lstrip()
+                if "\n" in text:
+                    head = text.split("\n")[0].rstrip()
+                    if head:
+                        yield head
+                    break
+                if text:
+                    seen_content = True
+                    yield text
+        finally:
+            thread.join()
+
+    def complete_many(
+        self,
+        prompts: list[str],
+        batch_size: int = 1,
+        token_budget: int = None,
+    ) -> list[str]:
+        """
+        Complete `prompts` in length-bucketed, left-padded batches of at most
+        `batch_size` prompts or `token_budget` padded tokens. Outputs are returned
+        in the order of `prompts`.
+        """
+        return self.complete_many_ids(self.encode(prompts), batch_size, token_budget)
+
+    def complete_many_ids(
+        self,
+        prompt_ids: list,
+        batch_size: int = 1,
+        token_budget: int = None,
+    ) -> list[str]:
+        """`complete_many` for already tokenized prompts (e.g. a `TokenDataset`)."""
+        completions = [""] * len(prompt_ids)
+        for i, output in self.iter_complete_ids(prompt_ids, batch_size, token_budget):
+            completions[i] = output
+        return completions
+
+    def iter_complete_ids(
+        self,
+        prompt_ids: list,
+        batch_size: int = 1,
+        token_budget: int = None,
+    ) -> Iterator[tuple[int, str]]:
+        """
+        Like `complete_many_ids`, but yield `(index, completion)` as soon as each
+        batch is done, in bucket order rather than prompt order.
+        """
+        buckets = make_length_buckets(
+            [len(ids) for ids in prompt_ids],
+            batch_size,
+            token_budget,
+            self.generation_config.max_new_tokens,
+        )
+        for bucket in tqdm(buckets, desc="Generating outputs", total=len(buckets)):
+            outputs = self._generate_ids([prompt_ids[i] for i in bucket])
+            yield from zip(bucket, outputs)
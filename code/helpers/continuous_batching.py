@@ -0,0 +1,245 @@
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import torch.nn.functional as F
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache
+
+from helpers.completion_engine import CompletionEngine, NewlineStoppingCriteria
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class _Sequence:
+    def __init__(self, prompt_ids: list[int], deadline: float, future: asyncio.Future):
+        self.prompt_ids = prompt_ids
+        self.deadline = deadline
+        self.future = future
+        self.generated = []
+
+
+def _pad_cache_left(cache: DynamicCache, length: int):
+    for layer in cache.layers:
+        pad = length - layer.keys.shape[-2]
+        if pad > 0:
+            layer.keys = F.pad(layer.keys, (0, 0, pad, 0))
+            layer.values = F.pad(layer.values, (0, 0, pad, 0))
+
+
+def _merge_caches(a: DynamicCache, b: DynamicCache) -> DynamicCache:
+    """Stack two left-padded caches along the batch dimension."""
+    length = max(a.get_seq_length(), b.get_seq_length())
+    _pad_cache_left(a, length)
+    _pad_cache_left(b, length)
+    for layer_a, layer_b in zip(a.layers, b.layers):
+        layer_a.keys = torch.cat([layer_a.keys, layer_b.keys])
+        layer_a.values = torch.cat([layer_a.values, layer_b.values])
+    return a
+
+
+class ContinuousBatcher:
+    """
+    Greedy single-line completion with continuous batching for a server.
+    Requests are queued by `submit`; between decode steps, waiting requests are
+    prefilled together and join the running batch (their left-padded KV cache is
+    stacked onto it), and every sequence that finished its line, hit EOS, ran
+    past its deadline or was cancelled leaves the batch right away. The model runs
+    on a single worker thread, so the event loop stays responsive.
+    """
+
+    def __init__(
+        self,
+        model: AutoModelForCausalLM,
+        tokenizer: AutoTokenizer,
+        max_batch_size: int = 8,
+        max_queue: int = 64,
+        max_new_tokens: int = 20,
+    ):
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = model.to(self.device)
+        self.model.eval()
+        self.tokenizer = tokenizer
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.newline_criteria = NewlineStoppingCriteria(
+            tokenizer, vocab_size=model.config.vocab_size
+        )
+        self.max_batch_size = max_batch_size
+        self.max_queue = max_queue
+        self.max_new_tokens = max_new_tokens
+
+        self.waiting = deque()
+        self.active = []
+        self.cache = None
+        self.attention_mask = None
+        self.next_tokens = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.wakeup = asyncio.Event()
+
+    async def submit(self, prompt: str, timeout: float = None) -> str:
+        """
+        Complete `prompt`. Raises `asyncio.TimeoutError` if the completion is not
+        done within `timeout` seconds and `QueueFullError` if too many requests
+        are waiting. Cancelling the awaiting task removes the request from the
+        batch at the next step. Raises `ValueError` for an empty prompt or a
+        non-positive timeout, before the request can join (and break) a batch.
+        """
+        if timeout is not None and (
+            isinstance(timeout, bool)
+            or not isinstance(timeout, (int, float))
+            or timeout <= 0
+        ):
+            raise ValueError(f"Invalid timeout {timeout!r}")
+        if len(self.waiting) >= self.max_queue:
+            raise QueueFullError(f"{len(self.waiting)} requests already queued")
+        prompt_ids = self.tokenizer(prompt, truncation=True)["input_ids"]
+        if not prompt_ids:
+            raise ValueError("Prompt is empty")
+        deadline = time.monotonic() + timeout if timeout else None
+        sequence = _Sequence(
+            prompt_ids, deadline, asyncio.get_running_loop().create_future()
+        )
+        self.waiting.append(sequence)
+        self.wakeup.set()
+        return await sequence.future
+
+    async def run(self):
+        """Scheduling loop; run it as a task next to the server."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.waiting and not self.active:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+
+            self._expire(self.waiting)
+            joining = []
+            while (
+                self.waiting and len(self.active) + len(joining) < self.max_batch_size
+            ):
+                joining.append(self.waiting.popleft())
+            try:
+                if joining:
+                    await loop.run_in_executor(self.executor, self._prefill, joining)
+                self._finish()
+                if self.active:
+                    await loop.run_in_executor(self.executor, self._decode_step)
+                    self._finish()
+            except Exception as e:
+                # fail the affected requests instead of leaving them hanging
+                for sequence in self.active + joining:
+                    if not sequence.future.done():
+                        sequence.future.set_exception(e)
+                self.active = []
+                self.cache = self.attention_mask = self.next_tokens = None
+
+    def _expire(self, sequences):
+        now = time.monotonic()
+        for sequence in list(sequences):
+            if sequence.future.done():
+                sequences.remove(sequence)
+            elif sequence.deadline is not None and now > sequence.deadline:
+                sequence.future.set_exception(asyncio.TimeoutError())
+                sequences.remove(sequence)
+
+    def _forward(self, input_ids, attention_mask, cache):
+        position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+        position_ids = position_ids[:, -input_ids.shape[1] :]
+        logits = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=cache,
+            use_cache=True,
+        ).logits
+        return logits[:, -1].argmax(dim=-1)
+
+    @torch.no_grad()
+    def _prefill(self, joining: list[_Sequence]):
+        inputs = self.tokenizer.pad(
+            {"input_ids": [s.prompt_ids for s in joining]},
+            padding=True,
+            padding_side="left",
+            return_tensors="pt",
+        ).to(self.device)
+        cache = DynamicCache()
+        next_tokens = self._forward(
+            inputs["input_ids"], inputs["attention_mask"], cache
+        )
+
+        if self.active:
+            length = max(
+                self.attention_mask.shape[1], inputs["attention_mask"].shape[1]
+            )
+            self.cache = _merge_caches(self.cache, cache)
+            self.attention_mask = torch.cat(
+                [
+                    F.pad(
+                        self.attention_mask, (length - self.attention_mask.shape[1], 0)
+                    ),
+                    F.pad(
+                        inputs["attention_mask"],
+                        (length - inputs["attention_mask"].shape[1], 0),
+                    ),
+                ]
+            )
+            self.next_tokens = torch.cat([self.next_tokens, next_tokens])
+        else:
+            self.cache = cache
+            self.attention_mask = inputs["attention_mask"]
+            self.next_tokens = next_tokens
+        self.active.extend(joining)
+        for sequence, token in zip(joining, next_tokens.tolist()):
+            sequence.generated.append(token)
+
+    @torch.no_grad()
+    def _decode_step(self):
+        self.attention_mask = F.pad(self.attention_mask, (0, 1), value=1)
+        self.next_tokens = self._forward(
+            self.next_tokens[:, None], self.attention_mask, self.cache
+        )
+        for sequence, token in zip(self.active, self.next_tokens.tolist()):
+            sequence.generated.append(token)
+
+    def _finish(self):
+        """Resolve finished sequences and drop them (and dead ones) from the batch."""
+        now = time.monotonic()
+        keep = []
+        for row, sequence in enumerate(self.active):
+            if sequence.future.done():
+                continue
+            if sequence.deadline is not None and now > sequence.deadline:
+                sequence.future.set_exception(asyncio.TimeoutError())
+                continue
+            generated = sequence.generated
+            if (
+                generated[-1] == self.tokenizer.eos_token_id
+                or self.newline_criteria.line_complete(generated)
+                or len(generated) >= self.max_new_tokens
+            ):
+                text = self.tokenizer.decode(generated, skip_special_tokens=True)
+                sequence.future.set_result(CompletionEngine.first_line(text))
+                continue
+            keep.append(row)
+
+        if len(keep) == len(self.active):
+            return
+        self.active = [self.active[row] for row in keep]
+        if not keep:
+            self.cache = self.attention_mask = self.next_tokens = None
+            return
+        index = torch.tensor(keep, device=self.device)
+        self.cache.batch_select_indices(index)
+        self.attention_mask = self.attention_mask[index]
+        self.next_tokens = self.next_tokens[index]
+
+        # drop leading columns that are padding for every remaining row
+        start = int(self.attention_mask.any(dim=0).int().argmax())
+        if start > 0:
+            self.attention_mask = self.attention_mask[:, start:]
+            for layer in self.cache.layers:
+                layer.keys = layer.keys[:, :, start:]
+                layer.values = layer.values[:, :, start:]
@@ -1,5 +1,14 @@
 import os
+import glob
 import json
+import gzip
+import hashlib
+from typing import Iterator
+
+
+def prompt_id(prompt: str) -> str:
+    """Stable snippet id used to join prediction files, independent of row order."""
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
 
 
 def convert_dataset_to_jsonl(input_dir: str, output_file: str, separator: str = "\n"):
@@ -12,8 +21,10 @@ def convert_dataset_to_jsonl(input_dir: str, output_file: str, separator: str =
                     os.path.join(input_dir, filename), "r", encoding="utf-8"
                 ) as f_in:
                     text = f_in.read()
-                    prompt, completion = text.split("__OUTPUT__: ")
-                    prompt = prompt.replace("__INPUT__: ", "").strip()
+                    # target is a single line, so the last marker at a line
+                    # start is the real one even if the source contains it
+                    prompt, completion = text.rsplit("\n__OUTPUT__: ", 1)
+                    prompt = prompt.removeprefix("__INPUT__: ").strip()
                     completion = completion.strip()
                     # combine prompt and completion with a separator
                     f_out.write(
@@ -21,3 +32,180 @@ def convert_dataset_to_jsonl(input_dir: str, output_file: str, separator: str =
                     )
 
     print(f"Dataset prepared at {output_file}")
+
+
+class JsonlSnippetWriter:
+    """
+    Stream (prefix, target) snippets straight into JSONL in the same
+    `{"text": prompt + separator + completion}` format as `convert_dataset_to_jsonl`.
+    With `shard_size`, a new `<name>-00000.jsonl` shard is started every
+    `shard_size` records; with `compress`, shards are gzip-compressed (`.jsonl.gz`).
+    Readers of the output (`deduplicate_jsonl`, `build_token_dataset`, ...) take
+    `output_file` and find the shards with `jsonl_files`.
+    """
+
+    def __init__(
+        self,
+        output_file: str,
+        separator: str = "\n",
+        shard_size: int = None,
+        compress: bool = False,
+    ):
+        self.output_file = output_file
+        self.separator = separator
+        self.shard_size = shard_size
+        self.compress = compress
+        self.count = 0
+        self.paths = []
+        self._file = None
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+
+    def _shard_path(self) -> str:
+        base = self.output_file.removesuffix(".gz").removesuffix(".jsonl")
+        if self.shard_size is not None:
+            base = f"{base}-{len(self.paths):05d}"
+        return base + (".jsonl.gz" if self.compress else ".jsonl")
+
+    def _open_next(self):
+        if self._file is not None:
+            self._file.close()
+        path = self._shard_path()
+        if self.compress:
+            self._file = gzip.open(path, "wt", encoding="utf-8")
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+        self.paths.append(path)
+
+    def write(self, prefix: str, target: str):
+        if self._file is None or (
+            self.shard_size is not None and self.count % self.shard_size == 0
+        ):
+            self._open_next()
+        text = f"{prefix.strip()}{self.separator}{target.strip()}"
+        self._file.write(json.dumps({"text": text}) + "\n")
+        self.count += 1
+
+    def write_all(self, snippets):
+        for _, prefix, target in snippets:
+            self.write(prefix, target)
+
+    def close(self):
+        if self._file is None:
+            # keep the output file present for empty datasets
+            self._open_next()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def jsonl_files(path: str) -> list[str]:
+    """
+    Files a `JsonlSnippetWriter` wrote for `output_file=path`: `path` itself, its
+    `.jsonl.gz` or its numbered shards (plain or gzipped), in shard order.
+    """
+    if os.path.exists(path):
+        return [path]
+    base = path.removesuffix(".gz").removesuffix(".jsonl")
+    if os.path.exists(f"{base}.jsonl.gz"):
+        return [f"{base}.jsonl.gz"]
+    shards = sorted(
+        glob.glob(f"{glob.escape(base)}-[0-9][0-9][0-9][0-9][0-9].jsonl")
+        + glob.glob(f"{glob.escape(base)}-[0-9][0-9][0-9][0-9][0-9].jsonl.gz")
+    )
+    if not shards:
+        raise FileNotFoundError(f"File not found: {path}")
+    return shards
+
+
+def iter_jsonl_lines(path: str) -> Iterator[str]:
+    """Lines of the JSONL `path`, read across shards and gzip (see `jsonl_files`)."""
+    for file in jsonl_files(path):
+        if file.endswith(".gz"):
+            f = gzip.open(file, "rt", encoding="utf-8")
+        else:
+            f = open(file, "r", encoding="utf-8")
+        with f:
+            yield from f
+
+
+def write_snippet_txt(output_dir: str, snippets):
+    """Write one `__INPUT__/__OUTPUT__` .txt file per snippet (legacy format)."""
+    os.makedirs(output_dir, exist_ok=True)
+    for i, (file_base, prefix, target) in enumerate(snippets, 1):
+        with open(f"{output_dir}/{file_base}_{i:03d}.txt", "w", encoding="utf-8") as f:
+            f.write(f"__INPUT__: {prefix}\n__OUTPUT__: {target}\n")
+
+
+class ResumableJsonlWriter:
+    """
+    Append-only JSONL writer for long runs. Every record is written as soon as
+    it is produced and the file is fsynced every `fsync_every` records. With
+    `resume`, an existing file is kept (a torn last line from a crash is cut off)
+    and the "id"s of its records are available in `completed`. With `model_hash`,
+    every record is stamped with it as "model" and resuming a file written by
+    another model raises `ValueError` instead of keeping its stale records.
+    """
+
+    def __init__(
+        self,
+        output_file: str,
+        resume: bool = True,
+        fsync_every: int = 32,
+        model_hash: str = None,
+    ):
+        self.output_file = output_file
+        self.fsync_every = fsync_every
+        self.model_hash = model_hash
+        self.completed = set()
+        self.count = 0
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+
+        if resume and os.path.exists(output_file):
+            valid_end = 0
+            with open(output_file, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                        self.completed.add(record["id"])
+                    except (json.JSONDecodeError, KeyError):
+                        break
+                    if model_hash and record.get("model") != model_hash:
+                        raise ValueError(
+                            f"{output_file} has predictions of another model or "
+                            "adapter, use resume=False or a new output file"
+                        )
+                    valid_end += len(line)
+            with open(output_file, "r+b") as f:
+                f.truncate(valid_end)
+            self._file = open(output_file, "a", encoding="utf-8")
+        else:
+            self._file = open(output_file, "w", encoding="utf-8")
+
+    def write(self, record: dict):
+        if self.model_hash:
+            record = {**record, "model": self.model_hash}
+        self._file.write(json.dumps(record) + "\n")
+        self.completed.add(record["id"])
+        self.count += 1
+        if self.count % self.fsync_every == 0:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
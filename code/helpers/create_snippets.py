@@ -1,99 +1,197 @@
+import ast
 import random
 
+from helpers.ts_scanner import scan_ts_functions
 
-def extract_structural_snippets(
-    lines: list,
-    num_snippets: int = 20,
-    max_prev_lines: int = None,
-):
-    """Extract code snippets from Python code."""
-    snippets = []
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-        if stripped and not (
-            stripped.startswith("#")
-            or stripped.startswith('"""')
-            or stripped.startswith("import")
-        ):
-            if i > 0:
-                start = max(0, i - max_prev_lines) if max_prev_lines is not None else 0
-                prefix = "".join(lines[start:i])
-                target = line.rstrip()
-                snippets.append((prefix, target))
-    return random.sample(snippets, min(num_snippets, len(snippets))) if snippets else []
-
-
-def extract_assignment_snippets(
+# bump whenever extraction output changes, invalidates incremental snippet caches
+EXTRACTOR_VERSION = 3
+
+
+class SourceFile:
+    """Shared per-file buffer that snippets point into."""
+
+    __slots__ = ("file_base", "lines", "imports")
+
+    def __init__(self, lines: list, file_base: str):
+        self.file_base = file_base
+        self.lines = lines
+        self.imports = "".join(
+            line for line in lines if line.strip().startswith("import")
+        )
+
+
+class Snippet:
+    """
+    Snippet stored as line offsets into a `SourceFile`: the prefix is the file's
+    imports plus `lines[start:target_line]`, the target is `lines[target_line]`.
+    The text is only built when accessed, so snippets of one function share the
+    file buffer instead of each holding a copy of all earlier lines. Unpacks like
+    the former `(file_base, prefix, target)` tuples.
+    """
+
+    __slots__ = ("source", "start", "target_line")
+
+    def __init__(self, source: SourceFile, start: int, target_line: int):
+        self.source = source
+        self.start = start
+        self.target_line = target_line
+
+    @property
+    def file_base(self) -> str:
+        return self.source.file_base
+
+    @property
+    def prefix(self) -> str:
+        lines = self.source.lines
+        return self.source.imports + "".join(lines[self.start : self.target_line])
+
+    @property
+    def target(self) -> str:
+        return self.source.lines[self.target_line]
+
+    def __iter__(self):
+        return iter((self.file_base, self.prefix, self.target))
+
+
+class PythonSnippet(Snippet):
+    """
+    Python snippet: the prefix is `lines[start:target_line]`. Structural
+    snippets target the whole statement line; assignment snippets end the
+    prefix with `<lhs> =` and target the right-hand side.
+    """
+
+    __slots__ = ("lhs", "rhs")
+
+    def __init__(
+        self,
+        source: SourceFile,
+        start: int,
+        target_line: int,
+        lhs: str = None,
+        rhs: str = None,
+    ):
+        super().__init__(source, start, target_line)
+        self.lhs = lhs
+        self.rhs = rhs
+
+    @property
+    def prefix(self) -> str:
+        prefix = "".join(self.source.lines[self.start : self.target_line])
+        return prefix + f"{self.lhs} =\n" if self.lhs is not None else prefix
+
+    @property
+    def target(self) -> str:
+        if self.lhs is not None:
+            return self.rhs
+        return self.source.lines[self.target_line].rstrip()
+
+
+def _is_docstring(node: ast.stmt) -> bool:
+    return (
+        isinstance(node, ast.Expr)
+        and isinstance(node.value, ast.Constant)
+        and isinstance(node.value.value, str)
+    )
+
+
+def _assignment_parts(node: ast.stmt, lines: list) -> tuple[str, str]:
+    """`(lhs, rhs)` text of a single-line assignment, None if it is not one."""
+    if not isinstance(node, (ast.Assign, ast.AnnAssign)) or node.value is None:
+        return None
+    value = node.value
+    if node.lineno != node.end_lineno or value.lineno != node.lineno:
+        return None
+    line = lines[node.lineno - 1]
+    # offsets are in utf-8 bytes
+    encoded = line.encode("utf-8")
+    lhs = encoded[node.col_offset : value.col_offset].decode("utf-8")
+    rhs = encoded[value.col_offset : value.end_col_offset].decode("utf-8")
+    lhs = lhs.rstrip().rstrip("=").strip()
+    return (lhs, rhs.strip()) if lhs and rhs.strip() else None
+
+
+def extract_python_snippets(
     lines: list,
-    num_snippets: int = 30,
+    file_base: str,
+    num_structural: int = 20,
+    num_assignments: int = 30,
     max_prev_lines: int = None,
 ):
     """
-    Extract assignment snippets (=) from Python code.
-    Inputs (x) are the code before and LHS of the assignment.
-    Targets (y) are the RHS of the assignment.
+    Extract snippets from Python code with a single `ast` pass.
+    Structural snippets target the first line of every statement (except
+    imports and docstrings) with all previous lines as input; assignment
+    snippets target the right-hand side of single-line `=` assignments inside
+    functions, with the code before and the LHS as input. Candidates are only
+    line numbers until `num_structural`/`num_assignments` of them are sampled,
+    so prefix text is built for the chosen snippets only (and only on access).
+    Files that do not parse yield no snippets.
     """
-    snippets = []
-    in_def = False
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-        if stripped.startswith("def "):
-            in_def = True
-        elif in_def and stripped and "=" in stripped and not stripped.startswith("#"):
-            if "=" in stripped.split(":")[-1]:
-                lhs, rhs = stripped.split("=", 1)
-                lhs, rhs = lhs.strip(), rhs.strip()
-                if rhs and not rhs.startswith("#"):
-                    start = (
-                        max(0, i - max_prev_lines) if max_prev_lines is not None else 0
-                    )
-                    prefix = "".join(lines[start:i]) + f"{lhs} =\n"
-                    snippets.append((prefix, rhs))
-        elif in_def and not stripped.startswith(" "):
-            in_def = False
-    return random.sample(snippets, min(num_snippets, len(snippets))) if snippets else []
+    try:
+        tree = ast.parse("".join(lines))
+    except (SyntaxError, ValueError):
+        return []
+
+    structural = set()
+    assignments = []
+
+    def visit(body: list, in_function: bool):
+        for node in body:
+            if not isinstance(node, (ast.Import, ast.ImportFrom)) and not (
+                _is_docstring(node)
+            ):
+                structural.add(node.lineno - 1)
+            if in_function:
+                parts = _assignment_parts(node, lines)
+                if parts:
+                    assignments.append((node.lineno - 1, *parts))
+            is_function = isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+            for field in ("body", "orelse", "finalbody"):
+                visit(getattr(node, field, []), in_function or is_function)
+            for handler in getattr(node, "handlers", []):
+                visit(handler.body, in_function or is_function)
+            for case in getattr(node, "cases", []):
+                visit(case.body, in_function or is_function)
+
+    visit(tree.body, False)
+
+    def start(line: int) -> int:
+        return max(0, line - max_prev_lines) if max_prev_lines is not None else 0
+
+    source = SourceFile(lines, file_base)
+    structural = sorted(line for line in structural if line > 0)
+    snippets = [
+        PythonSnippet(source, start(line), line)
+        for line in random.sample(structural, min(num_structural, len(structural)))
+    ]
+    snippets += [
+        PythonSnippet(source, start(line), line, lhs, rhs)
+        for line, lhs, rhs in random.sample(
+            assignments, min(num_assignments, len(assignments))
+        )
+    ]
+    return snippets
 
 
 def extract_function_snippets_ts(lines: list, file_base: str):
+    """
+    Extract function snippets from TypeScript code.
+    A third of the non-trivial lines inside each function (at least one) are
+    sampled as targets, with the imports and the function up to the target as
+    input.
 
+    (used for creating training set)
+    """
     snippets = []
-    imports = [line for line in lines if line.strip().startswith("import")]
-    in_function = False
-    function_start = 0
-    brace_count = 0
-    function_lines = []
-
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-        if (
-            stripped.startswith("export async function")
-            or stripped.startswith("export function")
-            or stripped.startswith("async function")
-            or stripped.startswith("function")
-        ) and not in_function:
-            in_function = True
-            function_start = i
-            brace_count = 0
-            function_lines = []
-
-        if in_function:
-            function_lines.append(line)
-            brace_count += stripped.count("{") - stripped.count("}")
-            if brace_count == 0 and i > function_start:
-                # filter and pick random targets
-                body_lines = [
-                    line for line in function_lines[1:-1] if len(line.strip()) > 1
-                ]
-                num_targets = max(1, len(body_lines) // 3)
-                if body_lines:
-                    target_lines = random.sample(
-                        body_lines, min(num_targets, len(body_lines))
-                    )
-                    for target in target_lines:
-                        target_idx = function_lines.index(target)
-                        prefix = "".join(imports) + "".join(function_lines[:target_idx])
-                        snippets.append((file_base, prefix, target))
-                in_function = False
+    source = SourceFile(lines, file_base)
+
+    for start, body, end in scan_ts_functions(lines):
+        # filter and pick random targets
+        body_lines = [i for i in range(body + 1, end) if len(lines[i].strip()) > 1]
+        if body_lines:
+            num_targets = max(1, len(body_lines) // 3)
+            for target_line in random.sample(body_lines, num_targets):
+                snippets.append(Snippet(source, start, target_line))
 
     return snippets
 
@@ -106,35 +204,12 @@ def extract_function_snippets_ts_full_each_line(lines: list, file_base: str):
     (used for creating evaluation set)
     """
     snippets = []
-    imports = [line for line in lines if line.strip().startswith("import")]
-    in_function = False
-    function_start = 0
-    brace_count = 0
-    function_lines = []
-
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-        if (
-            stripped.startswith("export async function")
-            or stripped.startswith("export function")
-            or stripped.startswith("async function")
-            or stripped.startswith("function")
-        ):
-            in_function = True
-            function_start = i
-            brace_count = 0
-            function_lines = []
-        if in_function:
-            function_lines.append(line)
-            brace_count += stripped.count("{") - stripped.count("}")
-            if brace_count > 0 and i > function_start + 1:  # After signature
-                prefix = "".join(imports) + "".join(
-                    function_lines[:-1]
-                )  # Imports + function up to last line
-                target = function_lines[-1]  # Last line as target
-                if len(target.strip()) > 1:
-                    snippets.append((file_base, prefix, target))
-            if brace_count == 0 and i > function_start:
-                in_function = False
+    source = SourceFile(lines, file_base)
+
+    for start, body, end in scan_ts_functions(lines):
+        for i in range(body + 1, end):
+            # imports + function up to line i as prefix, line i as target
+            if len(lines[i].strip()) > 1:
+                snippets.append(Snippet(source, start, i))
 
     return snippets
@@ -0,0 +1,148 @@
+import os
+import json
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from helpers.convert_data import iter_jsonl_lines
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def shingles(text: str, size: int = 5) -> set[int]:
+    """crc32 hashes of all `size`-token shingles of whitespace-split `text`."""
+    tokens = text.split()
+    if len(tokens) < size:
+        return {zlib.crc32(" ".join(tokens).encode("utf-8"))}
+    return {
+        zlib.crc32(" ".join(tokens[i : i + size]).encode("utf-8"))
+        for i in range(len(tokens) - size + 1)
+    }
+
+
+def lsh_params(threshold: float, num_perm: int) -> tuple[int, int]:
+    """
+    `(bands, rows)` with `bands * rows <= num_perm` whose LSH S-curve
+    `(1 / bands) ** (1 / rows)` is closest to `threshold`.
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class MinHashLSH:
+    """
+    MinHash signatures over token shingles with banded LSH lookup. `query`
+    returns the keys of inserted texts whose estimated Jaccard similarity with
+    the given signature is at least `threshold`.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        shingle_size: int = 5,
+        seed: int = 1,
+    ):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        rng = np.random.RandomState(seed)
+        # uint64 arithmetic wraps, so keep a * hash below 2**64
+        self.a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.tables = [defaultdict(list) for _ in range(self.bands)]
+        self.signatures = {}
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(shingles(text, self.shingle_size), dtype=np.uint64)
+        values = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % MERSENNE_PRIME
+        return values.min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows : (band + 1) * self.rows].tobytes()
+
+    def insert(self, key, signature: np.ndarray):
+        self.signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self.tables[band][band_key].append(key)
+
+    def query(self, signature: np.ndarray) -> list:
+        candidates = set()
+        for band, band_key in self._band_keys(signature):
+            candidates.update(self.tables[band].get(band_key, ()))
+        return [
+            key
+            for key in candidates
+            if np.mean(self.signatures[key] == signature) >= self.threshold
+        ]
+
+
+def deduplicate_jsonl(
+    input_path: str,
+    output_path: str,
+    eval_path: str = None,
+    threshold: float = 0.8,
+    num_perm: int = 128,
+    shingle_size: int = 5,
+    eval_separator: str = "__###__",
+    drop_eval_overlap: bool = True,
+) -> dict:
+    """
+    Copy the `{"text": ...}` JSONL `input_path` (or its `JsonlSnippetWriter`
+    shards) to `output_path` without
+    near-duplicates: a row is dropped if its MinHash Jaccard estimate against an
+    already kept row is at least `threshold`. With `eval_path`, training rows
+    that are near-duplicates of an evaluation snippet are counted as train/eval
+    overlap and (with `drop_eval_overlap`) dropped as well. Returns the counts.
+    """
+    eval_index = MinHashLSH(threshold, num_perm, shingle_size)
+    if eval_path:
+        for i, line in enumerate(iter_jsonl_lines(eval_path)):
+            if line.strip():
+                text = json.loads(line)["text"].replace(eval_separator, "\n")
+                eval_index.insert(i, eval_index.signature(text))
+
+    train_index = MinHashLSH(threshold, num_perm, shingle_size)
+    stats = {"total": 0, "kept": 0, "duplicates": 0, "eval_overlap": 0}
+    overlapping_eval = set()
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f_out:
+        for line in iter_jsonl_lines(input_path):
+            if not line.strip():
+                continue
+            stats["total"] += 1
+            signature = train_index.signature(json.loads(line)["text"])
+
+            matches = eval_index.query(signature) if eval_path else []
+            if matches:
+                stats["eval_overlap"] += 1
+                overlapping_eval.update(matches)
+                if drop_eval_overlap:
+                    continue
+            if train_index.query(signature):
+                stats["duplicates"] += 1
+                continue
+
+            train_index.insert(stats["total"], signature)
+            f_out.write(line if line.endswith("\n") else line + "\n")
+            stats["kept"] += 1
+
+    stats["eval_rows_overlapping"] = len(overlapping_eval)
+    stats["eval_rows"] = len(eval_index.signatures)
+    print(
+        f"Kept {stats['kept']}/{stats['total']} snippets, "
+        f"dropped {stats['duplicates']} near-duplicates (threshold {threshold})"
+    )
+    if eval_path:
+        print(
+            f"Train/eval overlap: {stats['eval_overlap']} training snippets match "
+            f"{stats['eval_rows_overlapping']}/{stats['eval_rows']} evaluation snippets"
+        )
+    return stats
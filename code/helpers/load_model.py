@@ -3,18 +3,65 @@ import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 from dotenv import load_dotenv
 
+CPU_BACKENDS = {
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+    "fp32": torch.float32,
+    # fp32 weights, linear layers quantized to int8 after loading
+    "int8": torch.float32,
+}
 
-def load_model(model_path: str) -> None:
 
+def model_size_bytes(model: torch.nn.Module) -> int:
+    """Bytes of all weights, including int8 packed params of quantized layers."""
+    size = 0
+    for value in model.state_dict().values():
+        tensors = value if isinstance(value, tuple) else (value,)
+        for tensor in tensors:
+            if isinstance(tensor, torch.Tensor):
+                size += tensor.numel() * tensor.element_size()
+    return size
+
+
+def quantize_int8(model: AutoModelForCausalLM) -> AutoModelForCausalLM:
+    """
+    Dynamic int8 quantization of the linear layers for CPU inference: weights
+    are stored as int8, activations are quantized on the fly. The LM head stays
+    in full precision since it is tied to the embeddings and most sensitive.
+    """
+    linear_layers = {
+        name
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and not name.endswith("lm_head")
+    }
+    return torch.ao.quantization.quantize_dynamic(
+        model, linear_layers, dtype=torch.qint8
+    )
+
+
+def load_model(model_path: str, backend: str = "fp16") -> None:
+    """
+    Load model and tokenizer on CPU. `backend` is one of `CPU_BACKENDS`: fp16
+    (default), bf16 or fp32 weights, or int8 dynamic quantization of the linear
+    layers. fp16 matmuls are slow on most CPUs, bf16/int8 are usually fastest.
+    """
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"File not found: {model_path}")
+    if backend not in CPU_BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, use one of {list(CPU_BACKENDS)}")
 
-    tokenizer = AutoTokenizer.from_pretrained(model_path, padding_side="left")
+    # if a prompt is still too long, keep its end (the code at the cursor)
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_path, padding_side="left", truncation_side="left"
+    )
     tokenizer.pad_token = tokenizer.eos_token
     model = AutoModelForCausalLM.from_pretrained(
-        model_path, torch_dtype=torch.float16, device_map="cpu"
+        model_path, torch_dtype=CPU_BACKENDS[backend], device_map="cpu"
     )
-    print("Model loaded!")
+    if backend == "int8":
+        model = quantize_int8(model)
+    model.eval()
+    print(f"Model loaded ({backend}, {model_size_bytes(model) / 1e9:.2f} GB)!")
 
     return model, tokenizer
 
@@ -0,0 +1,110 @@
+import math
+
+import psutil
+from transformers import AutoModelForCausalLM
+
+from helpers.load_model import model_size_bytes
+
+GB = 1024**3
+# interpreter, torch, tokenizer and dataset overhead
+FRAMEWORK_OVERHEAD = 1.5 * GB
+
+
+def activation_bytes(
+    config,
+    batch_size: int,
+    seq_length: int,
+    gradient_checkpointing: bool = True,
+    bytes_per_value: int = 2,
+) -> int:
+    """
+    Rough peak activation memory of one training step of a decoder-only model.
+    Per layer, the MLP and attention projections keep about 16 hidden-size
+    values per token plus the fp32 attention scores; with gradient checkpointing
+    only each layer's input is kept and one layer is recomputed at a time. The
+    fp32 logits and their gradient are counted on top.
+    """
+    hidden = config.hidden_size
+    inner = getattr(config, "n_inner", None) or 4 * hidden
+    tokens = batch_size * seq_length
+    layer = tokens * (10 * hidden + 2 * inner) * bytes_per_value
+    layer += batch_size * config.num_attention_heads * seq_length**2 * 4
+    if gradient_checkpointing:
+        layers = config.num_hidden_layers * tokens * hidden * bytes_per_value + layer
+    else:
+        layers = config.num_hidden_layers * layer
+    logits = 2 * tokens * config.vocab_size * 4
+    return layers + logits
+
+
+def optimizer_bytes(model: AutoModelForCausalLM) -> int:
+    """fp32 AdamW moments, master copy and gradient of the trainable parameters."""
+    trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    return trainable * 4 * 4
+
+
+def plan_training(
+    model: AutoModelForCausalLM,
+    max_length: int = 256,
+    memory_budget_gb: float = None,
+    effective_batch_size: int = 4,
+    gradient_checkpointing: bool = True,
+    max_batch_size: int = 16,
+    min_length: int = 64,
+) -> dict:
+    """
+    Pick micro-batch size, sequence length and gradient accumulation steps so
+    one training step of the loaded (LoRA-wrapped) `model` fits into
+    `memory_budget_gb`, capped at 90% of the RAM available to training (free RAM
+    plus the model itself). Sequence length is halved from `max_length` only if
+    a single sequence does not fit, then the batch is doubled while it fits;
+    accumulation makes up the rest of `effective_batch_size`.
+    """
+    model_bytes = model_size_bytes(model)
+    # the model is already loaded, so its memory is part of what is in use
+    available = psutil.virtual_memory().available + model_bytes
+    budget = 0.9 * available
+    if memory_budget_gb:
+        budget = min(budget, memory_budget_gb * GB)
+    free = budget - model_bytes - optimizer_bytes(model) - FRAMEWORK_OVERHEAD
+
+    def fits(batch_size, seq_length):
+        needed = activation_bytes(
+            model.config, batch_size, seq_length, gradient_checkpointing
+        )
+        return needed <= free
+
+    seq_length = max_length
+    while seq_length > min_length and not fits(1, seq_length):
+        seq_length //= 2
+    if not fits(1, seq_length):
+        raise MemoryError(
+            f"Model needs {model_bytes / GB:.1f} GB, not enough left of the "
+            f"{budget / GB:.1f} GB budget to train even one {seq_length}-token sequence"
+        )
+
+    batch_size = 1
+    while batch_size * 2 <= min(max_batch_size, effective_batch_size) and fits(
+        batch_size * 2, seq_length
+    ):
+        batch_size *= 2
+
+    plan = {
+        "budget_gb": budget / GB,
+        "model_gb": model_bytes / GB,
+        "activations_gb": activation_bytes(
+            model.config, batch_size, seq_length, gradient_checkpointing
+        )
+        / GB,
+        "batch_size": batch_size,
+        "max_length": seq_length,
+        "gradient_accumulation_steps": math.ceil(effective_batch_size / batch_size),
+        "gradient_checkpointing": gradient_checkpointing,
+    }
+    print(
+        f"Training plan for {plan['budget_gb']:.1f} GB: batch {batch_size} x "
+        f"{seq_length} tokens, {plan['gradient_accumulation_steps']} accumulation "
+        f"steps (model {plan['model_gb']:.1f} GB, "
+        f"activations ~{plan['activations_gb']:.1f} GB)"
+    )
+    return plan
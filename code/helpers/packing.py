@@ -0,0 +1,87 @@
+from itertools import chain
+
+import torch
+from transformers import AutoTokenizer
+
+
+def tokenize_with_loss_mask(
+    examples: dict,
+    tokenizer: AutoTokenizer,
+    max_length: int = 256,
+    separator: str = "\n",
+    mask_prompt: bool = False,
+) -> dict:
+    """
+    Tokenize `examples["text"]` without padding. `loss_mask` marks the tokens
+    that are trained on: everything, or with `mask_prompt` only the completion
+    after the last `separator`. Examples longer than `max_length` keep their
+    last tokens, where the completion is; with `max_length=None` (for
+    `pack_sequences`, which splits long examples) nothing is cut.
+    """
+    input_ids, loss_mask = [], []
+    for text in examples["text"]:
+        if mask_prompt and separator in text:
+            prompt, completion = text.rsplit(separator, 1)
+            prompt_ids = tokenizer(prompt + separator, add_special_tokens=False)[
+                "input_ids"
+            ]
+            completion_ids = tokenizer(completion, add_special_tokens=False)[
+                "input_ids"
+            ]
+            ids = prompt_ids + completion_ids
+            mask = [0] * len(prompt_ids) + [1] * len(completion_ids)
+        else:
+            ids = tokenizer(text)["input_ids"]
+            mask = [1] * len(ids)
+        if max_length:
+            ids, mask = ids[-max_length:], mask[-max_length:]
+        input_ids.append(ids)
+        loss_mask.append(mask)
+    return {"input_ids": input_ids, "loss_mask": loss_mask}
+
+
+def pack_sequences(examples: dict, block_size: int, eos_token_id: int) -> dict:
+    """
+    Concatenate tokenized examples, separated by EOS, and cut them into
+    `block_size` blocks (for `dataset.map(batched=True)`). The last block of each
+    map batch may be shorter and is padded by the collator.
+    """
+    input_ids = list(
+        chain.from_iterable(ids + [eos_token_id] for ids in examples["input_ids"])
+    )
+    loss_mask = list(chain.from_iterable(m + [1] for m in examples["loss_mask"]))
+    return {
+        "input_ids": [
+            input_ids[i : i + block_size] for i in range(0, len(input_ids), block_size)
+        ],
+        "loss_mask": [
+            loss_mask[i : i + block_size] for i in range(0, len(loss_mask), block_size)
+        ],
+    }
+
+
+class CausalLMCollator:
+    """
+    Pad a batch to its longest sequence and build `labels` on the fly: padding
+    and tokens with `loss_mask == 0` (e.g. the prompt) are set to -100.
+    """
+
+    def __init__(self, tokenizer: AutoTokenizer):
+        self.pad_token_id = tokenizer.pad_token_id
+
+    def __call__(self, features: list[dict]) -> dict:
+        length = max(len(f["input_ids"]) for f in features)
+        input_ids = torch.full((len(features), length), self.pad_token_id)
+        attention_mask = torch.zeros((len(features), length), dtype=torch.long)
+        labels = torch.full((len(features), length), -100)
+        for row, f in enumerate(features):
+            ids = torch.tensor(f["input_ids"])
+            mask = torch.tensor(f.get("loss_mask", [1] * len(ids)), dtype=torch.bool)
+            input_ids[row, : len(ids)] = ids
+            attention_mask[row, : len(ids)] = 1
+            labels[row, : len(ids)] = torch.where(mask, ids, -100)
+        return {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "labels": labels,
+        }
@@ -0,0 +1,35 @@
+from typing import Iterator
+
+from peft import PeftModel
+from transformers import AutoTokenizer
+from tqdm import tqdm
+
+from helpers.completion_engine import CompletionEngine, make_length_buckets
+
+
+def iter_paired_completions(
+    model: PeftModel,
+    tokenizer: AutoTokenizer,
+    prompt_ids: list,
+    batch_size: int = 1,
+    token_budget: int = None,
+) -> Iterator[tuple[int, str, str]]:
+    """
+    Complete every prompt with and without the LoRA adapter of `model` and yield
+    `(index, baseline, finetuned)` in bucket order. Each batch is padded and moved
+    to the device once and generated twice, the baseline pass inside
+    `disable_adapter()`, so a single copy of the base weights serves both models.
+    """
+    engine = CompletionEngine(model, tokenizer)
+    buckets = make_length_buckets(
+        [len(ids) for ids in prompt_ids],
+        batch_size,
+        token_budget,
+        engine.generation_config.max_new_tokens,
+    )
+    for bucket in tqdm(buckets, desc="Generating paired outputs"):
+        inputs = engine.pad_ids([prompt_ids[j] for j in bucket])
+        finetuned = engine.generate_padded(inputs)
+        with model.disable_adapter():
+            baseline = engine.generate_padded(inputs)
+        yield from zip(bucket, baseline, finetuned)
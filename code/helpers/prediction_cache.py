@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Callable
+
+import numpy as np
+from transformers import AutoModelForCausalLM
+
+# generation setup of run_model/CompletionEngine: greedy, first line only
+DEFAULT_GENERATION_PARAMS = {
+    "max_new_tokens": 20,
+    "do_sample": False,
+    "num_return_sequences": 1,
+    "stop": "first_line",
+}
+
+WEIGHT_FILES = (".safetensors", ".bin", ".json", ".model")
+
+
+def model_hash(
+    model: AutoModelForCausalLM, file_hash: Callable[[str], str] = None
+) -> str:
+    """
+    Hash of the model weights: the checkpoint files of the base model, plus
+    the in-memory adapter weights for PEFT models. Files are identified by
+    `file_hash` (e.g. `PredictionCache.file_hash`), or cheaply by size and mtime
+    when it is None, which also accepts models that are not local directories.
+    """
+    digest = hashlib.sha256()
+    model_dir = model.config.name_or_path
+    if os.path.isdir(model_dir):
+        for name in sorted(os.listdir(model_dir)):
+            if name.endswith(WEIGHT_FILES):
+                path = os.path.realpath(os.path.join(model_dir, name))
+                if file_hash is None:
+                    stat = os.stat(path)
+                    digest.update(f"{name}:{stat.st_size}:{stat.st_mtime}".encode())
+                else:
+                    digest.update(f"{name}:{file_hash(path)}".encode())
+    elif file_hash is None:
+        digest.update(model_dir.encode())
+    else:
+        raise ValueError(f"Cannot hash weights, not a local model: {model_dir}")
+
+    # same files loaded with another backend (dtype, int8) give other outputs
+    layer_types = sorted({type(module).__name__ for module in model.modules()})
+    digest.update(f"{model.dtype}:{layer_types}".encode())
+
+    if hasattr(model, "peft_config"):
+        for name, param in sorted(model.named_parameters()):
+            if "lora_" in name:
+                digest.update(name.encode())
+                digest.update(param.detach().float().cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Persistent SQLite cache of completions keyed by model weights hash, prompt
+    token ids and generation parameters, so repeated evaluation runs of an
+    unchanged model are cache hits. Entries are evicted least-recently-used
+    once the stored outputs exceed `max_bytes`. New entries are committed every
+    `commit_every` puts, so a crashed run keeps what it already generated.
+    """
+
+    def __init__(
+        self, path: str, max_bytes: int = 512 * 1024**2, commit_every: int = 32
+    ):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self.commit_every = commit_every
+        self.puts = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key TEXT PRIMARY KEY, output TEXT, size INTEGER, last_used REAL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS predictions_last_used "
+            "ON predictions (last_used)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS weights ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT)"
+        )
+        self.db.commit()
+        self.total_bytes = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM predictions"
+        ).fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def file_hash(self, path: str) -> str:
+        """sha256 of a weight file, memoized by size and mtime."""
+        stat = os.stat(path)
+        row = self.db.execute(
+            "SELECT size, mtime, hash FROM weights WHERE path = ?", (path,)
+        ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024**2), b""):
+                digest.update(chunk)
+        self.db.execute(
+            "INSERT OR REPLACE INTO weights VALUES (?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime, digest.hexdigest()),
+        )
+        self.db.commit()
+        return digest.hexdigest()
+
+    def model_hash(self, model: AutoModelForCausalLM) -> str:
+        """`model_hash` with content hashes of the weight files."""
+        return model_hash(model, self.file_hash)
+
+    @staticmethod
+    def key(model_hash: str, prompt_ids, generation_params: dict) -> str:
+        digest = hashlib.sha256(model_hash.encode())
+        digest.update(np.asarray(prompt_ids, dtype=np.int64).tobytes())
+        digest.update(json.dumps(generation_params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        row = self.db.execute(
+            "SELECT output FROM predictions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute(
+            "UPDATE predictions SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        return row[0]
+
+    def put(self, key: str, output: str):
+        size = len(output.encode("utf-8")) + len(key)
+        previous = self.db.execute(
+            "SELECT size FROM predictions WHERE key = ?", (key,)
+        ).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+            (key, output, size, time.time()),
+        )
+        self.total_bytes += size - (previous[0] if previous else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+        self.puts += 1
+        if self.puts % self.commit_every == 0:
+            self.db.commit()
+
+    def evict(self):
+        """Drop least-recently-used entries until 90% of `max_bytes` is used."""
+        target = int(self.max_bytes * 0.9)
+        rows = self.db.execute(
+            "SELECT key, size FROM predictions ORDER BY last_used"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.db.executemany("DELETE FROM predictions WHERE key = ?", evicted)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+        print(f"Prediction cache: {self.hits} hits, {self.misses} misses")
@@ -0,0 +1,114 @@
+import re
+
+import numpy as np
+from transformers import AutoTokenizer
+
+IDENTIFIER = re.compile(r"[A-Za-z_$][\w$]*")
+QUOTED = re.compile(r"(['\"`]).*?\1")
+IMPORT_KEYWORDS = {"import", "from", "as", "type", "typeof", "require", "const"}
+
+
+def imported_names(import_line: str) -> set[str]:
+    """Identifiers bound by an import line (module paths and keywords removed)."""
+    return set(IDENTIFIER.findall(QUOTED.sub("", import_line))) - IMPORT_KEYWORDS
+
+
+class PromptBuilder:
+    """
+    Assemble prompts within `max_tokens` tokens instead of truncating them.
+    A prompt is split into its import lines and the code before the cursor.
+    Code lines are kept from the cursor backwards using up to
+    `1 - import_share` of the budget; the rest is filled with the imports whose
+    names are used most in the kept code (unused imports are dropped), and any
+    budget left after that goes back to older code lines. Realized prompt
+    lengths are recorded for `report`.
+    """
+
+    def __init__(
+        self,
+        tokenizer: AutoTokenizer,
+        max_tokens: int = 1024,
+        import_share: float = 0.25,
+    ):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.import_share = import_share
+        self.lengths = []
+        self.original_lengths = []
+
+    def _count(self, lines: list[str]) -> list[int]:
+        if not lines:
+            return []
+        ids = self.tokenizer(lines, add_special_tokens=False)["input_ids"]
+        return [len(line_ids) for line_ids in ids]
+
+    def _take_from_end(self, counts: list[int], budget: int) -> tuple[int, int]:
+        """Index of the first of the trailing lines that fit in `budget`, tokens used."""
+        used = 0
+        start = len(counts)
+        while start > 0 and used + counts[start - 1] <= budget:
+            start -= 1
+            used += counts[start]
+        return start, used
+
+    def build(self, prompt: str) -> str:
+        lines = prompt.splitlines(keepends=True)
+        imports = [line for line in lines if line.strip().startswith("import")]
+        code = [line for line in lines if not line.strip().startswith("import")]
+        import_counts = self._count(imports)
+        code_counts = self._count(code)
+        self.original_lengths.append(sum(import_counts) + sum(code_counts))
+
+        if sum(import_counts) + sum(code_counts) <= self.max_tokens:
+            result = prompt
+        else:
+            code_budget = int(self.max_tokens * (1 - self.import_share))
+            start, used = self._take_from_end(code_counts, code_budget)
+            kept_code = code[start:]
+
+            # most relevant imports first, each only if it still fits
+            used_names = set(IDENTIFIER.findall("".join(kept_code)))
+            scores = [len(imported_names(line) & used_names) for line in imports]
+            kept_imports = set()
+            for i in sorted(range(len(imports)), key=lambda i: -scores[i]):
+                if scores[i] and used + import_counts[i] <= self.max_tokens:
+                    kept_imports.add(i)
+                    used += import_counts[i]
+
+            # leftover budget goes back to code further from the cursor
+            while start > 0 and used + code_counts[start - 1] <= self.max_tokens:
+                start -= 1
+                used += code_counts[start]
+
+            result = "".join(imports[i] for i in sorted(kept_imports))
+            result += "".join(code[start:])
+
+        ids = self.tokenizer(result, add_special_tokens=False)["input_ids"]
+        if len(ids) > self.max_tokens:
+            # single lines longer than the budget, or merges across lines
+            ids = ids[-self.max_tokens :]
+            result = self.tokenizer.decode(ids)
+        self.lengths.append(len(ids))
+        return result
+
+    def report(self) -> dict:
+        if not self.lengths:
+            return {}
+        lengths = np.asarray(self.lengths)
+        stats = {
+            "prompts": len(lengths),
+            "shortened": int(
+                sum(original > self.max_tokens for original in self.original_lengths)
+            ),
+            "mean": float(lengths.mean()),
+            "p50": float(np.percentile(lengths, 50)),
+            "p95": float(np.percentile(lengths, 95)),
+            "max": int(lengths.max()),
+        }
+        print(
+            f"Prompt lengths (budget {self.max_tokens} tokens): "
+            f"mean {stats['mean']:.0f}, p50 {stats['p50']:.0f}, "
+            f"p95 {stats['p95']:.0f}, max {stats['max']}, "
+            f"{stats['shortened']}/{stats['prompts']} shortened"
+        )
+        return stats
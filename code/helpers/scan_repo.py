@@ -0,0 +1,129 @@
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from typing import Callable, Iterator
+
+from tqdm import tqdm
+
+from helpers.snippet_cache import SnippetCache
+
+
+def is_excluded(name: str, filters_out: list[str] = None) -> bool:
+    return filters_out is not None and any(
+        f.lower() in name.lower() for f in filters_out
+    )
+
+
+def is_selected_file(
+    file: str,
+    file_types: list[str],
+    filters_out: list[str] = None,
+    filters_in: list[str] = None,
+) -> bool:
+    return (
+        file.split(".")[-1] in file_types
+        and not is_excluded(file, filters_out)
+        and (filters_in is None or any(f.lower() in file.lower() for f in filters_in))
+    )
+
+
+def find_source_files(
+    source_dirs: list[str],
+    file_types: list[str],
+    filters_out: list[str] = None,
+    filters_in: list[str] = None,
+) -> list[str]:
+    """
+    Walk `source_dirs` and return matching files in a stable (sorted) order.
+    Directories whose name matches `filters_out` (e.g. node_modules, dist, cache)
+    are pruned before descending into them.
+    """
+    paths = []
+    for source_dir in source_dirs:
+        if not os.path.isdir(source_dir):
+            print(f"Warning: {source_dir} not found. Skipping.")
+            continue
+        for root, dirs, files in os.walk(source_dir):
+            dirs[:] = sorted(d for d in dirs if not is_excluded(d, filters_out))
+            paths.extend(
+                os.path.join(root, file)
+                for file in sorted(files)
+                if is_selected_file(file, file_types, filters_out, filters_in)
+            )
+    return paths
+
+
+def relative_name(path: str, source_dirs: list[str]) -> str:
+    """`path` relative to the source dir containing it (stable across checkouts)."""
+    for source_dir in source_dirs:
+        relative = os.path.relpath(path, source_dir)
+        if not relative.startswith(os.pardir):
+            return relative.replace(os.sep, "/")
+    return os.path.basename(path)
+
+
+def extract_file(path: str, name: str, extractor: Callable, seed: int = None) -> list:
+    """
+    Run `extractor` on the file at `path`. With `seed`, the `random` module is
+    seeded per file from `seed` and `name` (the path relative to its source
+    dir), so sampling depends neither on worker scheduling nor on where the
+    repository is checked out; the caller's `random` state is restored after.
+    """
+    file_base = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    if seed is None:
+        return extractor(lines, file_base)
+    state = random.getstate()
+    random.seed(f"{seed}:{name}")
+    try:
+        return extractor(lines, file_base)
+    finally:
+        random.setstate(state)
+
+
+def iter_repo_snippets(
+    source_dirs: list[str],
+    file_types: list[str],
+    extractor: Callable,
+    filters_out: list[str] = None,
+    filters_in: list[str] = None,
+    workers: int = None,
+    seed: int = None,
+    cache: SnippetCache = None,
+) -> Iterator[tuple[str, list]]:
+    """
+    Yield `(path, snippets)` for every matching file, in `find_source_files` order.
+    With `workers` > 1, reading and extraction are fanned out to a process pool;
+    `extractor(lines, file_base)` must then be a module-level function.
+    With a `cache`, only files that are new or changed since the last run are
+    extracted; the manifest is saved once all files have been yielded.
+    """
+    paths = find_source_files(source_dirs, file_types, filters_out, filters_in)
+    cached = {}
+    if cache is not None:
+        cached = {path: cache.lookup(path) for path in paths}
+    todo = [path for path in paths if cached.get(path) is None]
+    names = [relative_name(path, source_dirs) for path in todo]
+    extract = partial(extract_file, extractor=extractor, seed=seed)
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    with pool or nullcontext():
+        if pool is None:
+            results = map(extract, todo, names)
+        else:
+            chunksize = max(1, len(todo) // workers // 8)
+            results = pool.map(extract, todo, names, chunksize=chunksize)
+
+        for path in tqdm(paths, desc="Processing files"):
+            snippets = cached.get(path)
+            if snippets is None:
+                snippets = next(results)
+                if cache is not None:
+                    cache.store(path, snippets)
+            yield path, snippets
+
+    if cache is not None:
+        cache.save()
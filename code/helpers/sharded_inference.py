@@ -0,0 +1,133 @@
+import os
+import queue as queue_module
+import traceback
+import multiprocessing as mp
+from typing import Iterator
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from helpers.completion_engine import CompletionEngine
+from helpers.prefix_cache import iter_prefix_cached
+
+
+def _shard_worker(
+    queue: mp.Queue,
+    model: AutoModelForCausalLM,
+    tokenizer: AutoTokenizer,
+    positions: list[int],
+    prompts: list[str],
+    prompt_ids: list,
+    threads: int,
+    batch_size: int,
+    token_budget: int,
+    prefix_cache: bool,
+):
+    try:
+        torch.set_num_threads(threads)
+        if prefix_cache:
+            outputs = iter_prefix_cached(model, tokenizer, prompts)
+        else:
+            engine = CompletionEngine(model, tokenizer, device="cpu")
+            if prompt_ids is None:
+                prompt_ids = engine.encode(prompts)
+            outputs = engine.iter_complete_ids(prompt_ids, batch_size, token_budget)
+        for i, output in outputs:
+            queue.put((positions[i], output))
+        queue.put(None)
+    except Exception:
+        queue.put(("error", traceback.format_exc()))
+
+
+def iter_sharded_completions(
+    model: AutoModelForCausalLM,
+    tokenizer: AutoTokenizer,
+    prompts: list[str],
+    prompt_ids: list = None,
+    num_workers: int = 2,
+    threads_per_worker: int = None,
+    batch_size: int = 1,
+    token_budget: int = None,
+    prefix_cache: bool = False,
+    ordered: bool = False,
+) -> Iterator[tuple[int, str]]:
+    """
+    Complete `prompts` on CPU with `num_workers` processes and yield
+    `(index, completion)` as soon as each result arrives.
+
+    The model is moved to shared memory once and the workers are forked from this
+    process, so all of them use the same weights instead of each loading a copy.
+    Each worker runs `threads_per_worker` intra-op threads (default: cores divided
+    by workers) and streams results back through a queue. With `ordered`, results
+    are yielded in prompt order instead; those that arrive ahead of order are
+    buffered until the gap is filled, which can hold back almost everything when
+    an early prompt finishes last. With `prefix_cache`, prompts are sharded in
+    contiguous sorted runs so shared prefixes stay in one worker.
+    """
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+    model.to("cpu")
+    model.eval()
+    model.share_memory()
+
+    order = list(range(len(prompts)))
+    if prefix_cache:
+        order.sort(key=lambda i: prompts[i])
+        chunk = -(-len(order) // num_workers)
+        shards = [order[k : k + chunk] for k in range(0, len(order), chunk)]
+    else:
+        shards = [order[k::num_workers] for k in range(num_workers)]
+    shards = [shard for shard in shards if shard]
+
+    ctx = mp.get_context("fork")
+    queue = ctx.Queue()
+    workers = [
+        ctx.Process(
+            target=_shard_worker,
+            args=(
+                queue,
+                model,
+                tokenizer,
+                shard,
+                [prompts[i] for i in shard],
+                None if prompt_ids is None else [prompt_ids[i] for i in shard],
+                threads,
+                batch_size,
+                token_budget,
+                prefix_cache,
+            ),
+            daemon=True,
+        )
+        for shard in shards
+    ]
+    for worker in workers:
+        worker.start()
+
+    buffered = {}
+    next_index = 0
+    running = len(workers)
+    try:
+        while running:
+            try:
+                message = queue.get(timeout=10)
+            except queue_module.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError("Inference workers exited without finishing")
+                continue
+            if message is None:
+                running -= 1
+                continue
+            if message[0] == "error":
+                raise RuntimeError(f"Inference worker failed:\n{message[1]}")
+            index, output = message
+            if not ordered:
+                yield index, output
+                continue
+            buffered[index] = output
+            while next_index in buffered:
+                yield next_index, buffered.pop(next_index)
+                next_index += 1
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
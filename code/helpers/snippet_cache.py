@@ -0,0 +1,126 @@
+import os
+import json
+import pickle
+import hashlib
+import subprocess
+from typing import Callable
+
+from helpers.create_snippets import EXTRACTOR_VERSION
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def changed_files_from_git(repo_dir: str, revisions: str) -> set[str]:
+    """
+    Absolute paths of files changed in `revisions` (e.g. "HEAD~1..HEAD"),
+    as reported by `git diff --name-only`.
+    """
+    top = subprocess.run(
+        ["git", "-C", repo_dir, "rev-parse", "--show-toplevel"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    names = subprocess.run(
+        ["git", "-C", top, "diff", "--name-only", revisions],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.splitlines()
+    return {os.path.realpath(os.path.join(top, name)) for name in names}
+
+
+class SnippetCache:
+    """
+    On-disk manifest mapping each source file's path and content hash to its
+    extracted snippets, so unchanged files are not extracted again.
+
+    The manifest is keyed by the extractor, `EXTRACTOR_VERSION` and `params`
+    (anything else that changes the output, e.g. the seed); if any of them
+    changes, all cached entries are ignored. With `changed_files` (see
+    `changed_files_from_git`), files outside that set that are already in the
+    manifest are trusted without being read and hashed.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        extractor: Callable,
+        params: dict = None,
+        changed_files: set[str] = None,
+    ):
+        self.cache_dir = cache_dir
+        self.changed_files = changed_files
+        self.key = hashlib.sha256(
+            json.dumps(
+                {
+                    "extractor": f"{extractor.__module__}.{extractor.__qualname__}",
+                    "version": EXTRACTOR_VERSION,
+                    "params": params or {},
+                },
+                sort_keys=True,
+            ).encode()
+        ).hexdigest()
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.files = {}
+        self.seen = {}
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.join(cache_dir, "snippets"), exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("key") == self.key:
+                self.files = manifest["files"]
+
+    def _entry_path(self, path: str, digest: str) -> str:
+        name = hashlib.sha256(f"{path}:{digest}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, "snippets", f"{name}.pkl")
+
+    def lookup(self, path: str):
+        """Return the cached snippets of `path`, or None if it must be extracted."""
+        path = os.path.realpath(path)
+        cached_digest = self.files.get(path)
+        if (
+            cached_digest is not None
+            and self.changed_files is not None
+            and path not in self.changed_files
+        ):
+            digest = cached_digest
+        else:
+            digest = file_digest(path)
+        self.seen[path] = digest
+
+        entry = self._entry_path(path, digest)
+        if digest != cached_digest or not os.path.exists(entry):
+            self.misses += 1
+            return None
+        with open(entry, "rb") as f:
+            self.hits += 1
+            return pickle.load(f)
+
+    def store(self, path: str, snippets: list):
+        path = os.path.realpath(path)
+        digest = self.seen.get(path) or file_digest(path)
+        self.seen[path] = digest
+        with open(self._entry_path(path, digest), "wb") as f:
+            pickle.dump(snippets, f)
+
+    def save(self):
+        """Write the manifest for the files seen in this run and drop stale entries."""
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"key": self.key, "files": self.seen}, f, indent=2)
+
+        keep = {
+            os.path.basename(self._entry_path(path, digest))
+            for path, digest in self.seen.items()
+        }
+        entries_dir = os.path.join(self.cache_dir, "snippets")
+        for name in os.listdir(entries_dir):
+            if name not in keep:
+                os.remove(os.path.join(entries_dir, name))
+        print(f"Snippet cache: {self.hits} files reused, {self.misses} files extracted")
@@ -0,0 +1,153 @@
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache
+from tqdm import tqdm
+
+from helpers.completion_engine import CompletionEngine, NewlineStoppingCriteria
+from helpers.prefix_cache import crop_cache
+from helpers.scan_repo import find_source_files
+
+
+class NgramIndex:
+    """
+    Map every `n`-gram of the indexed token sequences to the tokens that followed
+    its last occurrence, for drafting continuations of code that is copied
+    around the repository (identifiers, imports, repeated statements).
+    """
+
+    def __init__(self, n: int = 3, max_draft: int = 8):
+        self.n = n
+        self.max_draft = max_draft
+        self.continuations = {}
+
+    def add(self, token_ids: list[int]):
+        n = self.n
+        for i in range(len(token_ids) - n):
+            self.continuations[tuple(token_ids[i : i + n])] = (token_ids, i + n)
+
+    def draft(self, context: list[int], max_tokens: int = None) -> list[int]:
+        if max_tokens is None or max_tokens > self.max_draft:
+            max_tokens = self.max_draft
+        found = self.continuations.get(tuple(context[-self.n :]))
+        if found is None:
+            return []
+        token_ids, start = found
+        return list(token_ids[start : start + max_tokens])
+
+
+def lookup_prompt(context: list[int], n: int, max_tokens: int) -> list[int]:
+    """Prompt lookup: continuation of the latest earlier occurrence of the last n-gram."""
+    if len(context) <= n:
+        return []
+    suffix = context[-n:]
+    for start in range(len(context) - n - 1, -1, -1):
+        if context[start : start + n] == suffix:
+            return context[start + n : start + n + max_tokens]
+    return []
+
+
+def build_repo_index(
+    source_dirs: list[str],
+    file_types: list[str],
+    tokenizer: AutoTokenizer,
+    filters_out: list[str] = None,
+    filters_in: list[str] = None,
+    n: int = 3,
+    max_draft: int = 8,
+) -> NgramIndex:
+    """`NgramIndex` over the tokenized source files that the dataset scripts walk."""
+    index = NgramIndex(n, max_draft)
+    paths = find_source_files(source_dirs, file_types, filters_out, filters_in)
+    for path in tqdm(paths, desc="Indexing repo n-grams"):
+        with open(path, "r", encoding="utf-8") as f:
+            index.add(tokenizer(f.read(), add_special_tokens=False)["input_ids"])
+    print(f"Indexed {len(index.continuations)} n-grams from {len(paths)} files")
+    return index
+
+
+class SpeculativeDecoder:
+    """
+    Greedy single-line completion with n-gram speculative decoding. At every
+    step a draft is looked up in the prompt (and, if given, the repo `index`),
+    the pending token and the whole draft are run through the model in one
+    forward pass, and the longest prefix of the draft that matches the model's
+    own argmax is accepted together with the model's next token. Rejected tokens
+    are cropped from the KV cache, so the output is exactly the greedy output,
+    produced in fewer forward passes when the code repeats.
+    """
+
+    def __init__(
+        self,
+        model: AutoModelForCausalLM,
+        tokenizer: AutoTokenizer,
+        index: NgramIndex = None,
+        max_new_tokens: int = 20,
+        n: int = 3,
+        max_draft: int = 8,
+    ):
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = model.to(self.device)
+        self.model.eval()
+        self.tokenizer = tokenizer
+        self.index = index
+        self.max_new_tokens = max_new_tokens
+        self.n = index.n if index else n
+        self.max_draft = index.max_draft if index else max_draft
+        self.newline_criteria = NewlineStoppingCriteria(
+            tokenizer, vocab_size=model.config.vocab_size
+        )
+        self.forward_passes = 0
+        self.generated_tokens = 0
+
+    def _draft(self, context: list[int], max_tokens: int) -> list[int]:
+        draft = lookup_prompt(context, self.n, max_tokens)
+        if not draft and self.index is not None:
+            draft = self.index.draft(context, max_tokens)
+        return draft
+
+    def _done(self, generated: list[int]) -> bool:
+        return (
+            generated[-1] == self.tokenizer.eos_token_id
+            or self.newline_criteria.line_complete(generated)
+            or len(generated) >= self.max_new_tokens
+        )
+
+    def _forward(self, token_ids: list[int], cache: DynamicCache) -> list[int]:
+        self.forward_passes += 1
+        input_ids = torch.tensor([token_ids], device=self.device)
+        logits = self.model(
+            input_ids=input_ids, past_key_values=cache, use_cache=True
+        ).logits
+        return logits[0].argmax(dim=-1).tolist()
+
+    @torch.no_grad()
+    def complete_ids(self, prompt_ids: list[int]) -> str:
+        prompt_ids = [int(i) for i in prompt_ids]
+        if not prompt_ids:
+            return ""
+        cache = DynamicCache()
+        generated = [self._forward(prompt_ids, cache)[-1]]
+
+        while not self._done(generated):
+            # the last generated token is not in the cache yet
+            cached = cache.get_seq_length()
+            draft = self._draft(
+                prompt_ids + generated, self.max_new_tokens - len(generated) - 1
+            )
+            predicted = self._forward([generated[-1]] + draft, cache)
+
+            accepted = 0
+            while accepted < len(draft) and draft[accepted] == predicted[accepted]:
+                accepted += 1
+            crop_cache(cache, cached + 1 + accepted)
+
+            for token in draft[:accepted] + [predicted[accepted]]:
+                generated.append(token)
+                if self._done(generated):
+                    break
+
+        self.generated_tokens += len(generated)
+        text = self.tokenizer.decode(generated, skip_special_tokens=True)
+        return CompletionEngine.first_line(text)
+
+    def complete(self, prompt: str) -> str:
+        return self.complete_ids(self.tokenizer(prompt, truncation=True)["input_ids"])
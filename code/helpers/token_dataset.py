@@ -0,0 +1,208 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer
+
+from helpers.convert_data import iter_jsonl_lines
+
+
+def tokenizer_hash(tokenizer: AutoTokenizer) -> str:
+    if tokenizer.is_fast:
+        state = tokenizer.backend_tokenizer.to_str()
+    else:
+        state = json.dumps(tokenizer.get_vocab(), sort_keys=True)
+    return hashlib.sha256(state.encode()).hexdigest()
+
+
+def build_token_dataset(
+    jsonl_path: str,
+    output_prefix: str,
+    tokenizer: AutoTokenizer,
+    separator: str = "\n",
+    chunk_size: int = 1024,
+):
+    """
+    Pre-tokenize a `{"text": prompt + separator + target}` JSONL file (or its
+    `JsonlSnippetWriter` shards) into a flat
+    token file `<output_prefix>.bin` (uint16, or uint32 for large vocabularies)
+    with an EOS after every sample, plus:
+      - `<output_prefix>.offsets.npy`: start of each sample (n + 1 entries)
+      - `<output_prefix>.splits.npy`: (prompt end, target start) per sample, -1
+        if the text has no separator
+      - `<output_prefix>.json`: metadata incl. the tokenizer hash
+    Prompt and target are stripped like in `generate_completion_outputs`.
+    """
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max else np.uint32
+    separator_ids = tokenizer(separator, add_special_tokens=False)["input_ids"]
+    offsets = [0]
+    splits = []
+
+    def flush(texts, f_out):
+        pairs = [
+            text.rsplit(separator, 1) if separator in text else (text, None)
+            for text in texts
+        ]
+        prompts = tokenizer(
+            [prompt.strip() for prompt, _ in pairs], add_special_tokens=False
+        )["input_ids"]
+        targets = tokenizer(
+            [(target or "").strip() for _, target in pairs], add_special_tokens=False
+        )["input_ids"]
+        for (_, target), prompt_ids, target_ids in zip(pairs, prompts, targets):
+            if target is None:
+                ids = prompt_ids
+                splits.append((-1, -1))
+            else:
+                ids = prompt_ids + separator_ids + target_ids
+                splits.append((len(prompt_ids), len(prompt_ids) + len(separator_ids)))
+            ids.append(tokenizer.eos_token_id)
+            np.asarray(ids, dtype=dtype).tofile(f_out)
+            offsets.append(offsets[-1] + len(ids))
+
+    os.makedirs(os.path.dirname(output_prefix) or ".", exist_ok=True)
+    with open(f"{output_prefix}.bin", "wb") as f_out:
+        texts = []
+        for line in iter_jsonl_lines(jsonl_path):
+            if not line.strip():
+                continue
+            texts.append(json.loads(line)["text"])
+            if len(texts) == chunk_size:
+                flush(texts, f_out)
+                texts = []
+        if texts:
+            flush(texts, f_out)
+
+    np.save(f"{output_prefix}.offsets.npy", np.asarray(offsets, dtype=np.int64))
+    np.save(f"{output_prefix}.splits.npy", np.asarray(splits, dtype=np.int64))
+    with open(f"{output_prefix}.json", "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "source": os.path.abspath(jsonl_path),
+                "dtype": np.dtype(dtype).name,
+                "num_samples": len(splits),
+                "num_tokens": offsets[-1],
+                "separator": separator,
+                "eos_token_id": tokenizer.eos_token_id,
+                "tokenizer_hash": tokenizer_hash(tokenizer),
+            },
+            f,
+            indent=2,
+        )
+    print(
+        f"Token dataset with {len(splits)} samples, {offsets[-1]} tokens saved to {output_prefix}.bin"
+    )
+
+
+class TokenDataset:
+    """
+    Read-only view of a pre-tokenized dataset written by `build_token_dataset`.
+    Token ids are memory-mapped, so samples are zero-copy numpy views and
+    resident memory does not grow with the dataset size.
+    """
+
+    def __init__(self, prefix: str, tokenizer: AutoTokenizer = None):
+        with open(f"{prefix}.json", "r", encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        if tokenizer is not None and (
+            tokenizer_hash(tokenizer) != self.metadata["tokenizer_hash"]
+        ):
+            raise ValueError(
+                f"Token dataset {prefix} was built with a different tokenizer"
+            )
+        self.tokens = np.memmap(f"{prefix}.bin", dtype=self.metadata["dtype"], mode="r")
+        self.offsets = np.load(f"{prefix}.offsets.npy", mmap_mode="r")
+        self.splits = np.load(f"{prefix}.splits.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.metadata["num_samples"]
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        """Token ids of sample `i`, without the trailing EOS."""
+        return self.tokens[self.offsets[i] : self.offsets[i + 1] - 1]
+
+    def prompt_ids(self, i: int) -> np.ndarray:
+        prompt_end = self.splits[i][0]
+        return self[i] if prompt_end < 0 else self[i][:prompt_end]
+
+    def target_ids(self, i: int) -> np.ndarray:
+        target_start = self.splits[i][1]
+        return self[i][:0] if target_start < 0 else self[i][target_start:]
+
+
+class TokenTrainingDataset(torch.utils.data.Dataset):
+    """
+    Training view over a `TokenDataset` producing `input_ids`/`loss_mask` features
+    for `CausalLMCollator`. Uses `num_samples` samples (default: all) drawn at
+    random with `seed`, like `dataset.shuffle(seed).select(...)` for a JSONL file.
+    With `packing`, items are consecutive `max_length` blocks of the selected
+    samples concatenated (samples are already EOS-separated); otherwise items are
+    single samples cut to their last `max_length` tokens. With `mask_prompt`,
+    only target tokens (and EOS) are trained on.
+    """
+
+    def __init__(
+        self,
+        tokens: TokenDataset,
+        max_length: int = 256,
+        packing: bool = True,
+        mask_prompt: bool = False,
+        num_samples: int = None,
+        seed: int = 42,
+    ):
+        self.tokens = tokens
+        self.max_length = max_length
+        self.packing = packing
+        self.mask_prompt = mask_prompt
+        self.num_samples = min(num_samples or len(tokens), len(tokens))
+        rng = np.random.default_rng(seed)
+        self.samples = rng.permutation(len(tokens))[: self.num_samples]
+        offsets = np.asarray(tokens.offsets)
+        lengths = offsets[self.samples + 1] - offsets[self.samples]
+        # start of each selected sample in their concatenation (incl. EOS)
+        self.starts = np.concatenate([[0], np.cumsum(lengths)])
+        self.num_tokens = int(self.starts[-1])
+
+    def __len__(self) -> int:
+        if self.packing:
+            return -(-self.num_tokens // self.max_length)
+        return self.num_samples
+
+    def _sample_slice(self, sample: int, start: int, end: int) -> tuple[list, list]:
+        """Token ids and loss mask of positions [start, end) of sample `sample`."""
+        offset = int(self.tokens.offsets[sample])
+        ids = self.tokens.tokens[offset + start : offset + end].tolist()
+        target_start = int(self.tokens.splits[sample][1])
+        if not self.mask_prompt or target_start < 0:
+            return ids, [1] * len(ids)
+        mask = (np.arange(start, end) >= target_start).astype(np.int64)
+        return ids, mask.tolist()
+
+    def __getitem__(self, i: int) -> dict:
+        if not self.packing:
+            sample = int(self.samples[i])
+            # without the trailing EOS
+            length = int(self.tokens.offsets[sample + 1] - self.tokens.offsets[sample])
+            end = length - 1
+            # keep the end of long samples so the target survives truncation
+            start = max(0, end - self.max_length)
+            ids, mask = self._sample_slice(sample, start, end)
+            return {"input_ids": ids, "loss_mask": mask}
+
+        start = i * self.max_length
+        end = min(start + self.max_length, self.num_tokens)
+        input_ids, loss_mask = [], []
+        k = int(np.searchsorted(self.starts, start, side="right")) - 1
+        while k < self.num_samples and self.starts[k] < end:
+            sample_start = int(self.starts[k])
+            ids, mask = self._sample_slice(
+                int(self.samples[k]),
+                max(start, sample_start) - sample_start,
+                min(end, int(self.starts[k + 1])) - sample_start,
+            )
+            input_ids += ids
+            loss_mask += mask
+            k += 1
+        return {"input_ids": input_ids, "loss_mask": loss_mask}
@@ -0,0 +1,260 @@
+from typing import Iterator
+
+# a `/` after these tokens starts a regex literal, otherwise it is a division
+REGEX_PRECEDERS = set("(,=:[!&|?{};+-*%<>~^") | {
+    "=>",
+    "return",
+    "typeof",
+    "case",
+    "do",
+    "else",
+    "in",
+    "of",
+    "new",
+    "delete",
+    "void",
+    "throw",
+    "yield",
+    "await",
+}
+# a line ending in these tokens continues the statement on the next line
+CONTINUATIONS = set(",=([.+-*/%&|?:<>!") | {"=>", "extends", "implements"}
+CONTROL_KEYWORDS = {"if", "for", "while", "switch", "catch", "with"}
+TYPE_KEYWORDS = {"type", "interface"}
+MODIFIERS = {"export", "declare", "default"}
+
+
+class _Statement:
+    """Tokens seen since the last statement boundary at one brace level."""
+
+    __slots__ = (
+        "start",
+        "first",
+        "words",
+        "paren_depth",
+        "has_paren",
+        "last",
+        "annotation",
+        "angle_depth",
+    )
+
+    def __init__(self):
+        self.start = None
+        self.first = None
+        self.words = set()
+        self.paren_depth = 0
+        self.has_paren = False
+        self.last = None
+        # inside a return type annotation (`): ...`), where `<`/`>` are brackets
+        self.annotation = False
+        self.angle_depth = 0
+
+
+def _brace_kind(statement: _Statement, enclosing: str) -> str:
+    if enclosing in ("type", "annotation") or statement.first in TYPE_KEYWORDS:
+        return "type"
+    if statement.last == "=>":
+        return "function"
+    # object type in a return annotation, e.g. `): Promise<{ a: T }> {`
+    if statement.annotation and (
+        statement.angle_depth > 0 or statement.last in (":", "|", "&", ",")
+    ):
+        return "annotation"
+    if statement.paren_depth == 0 and "function" in statement.words:
+        return "function"
+    if statement.paren_depth == 0 and "class" in statement.words:
+        return "class"
+    if (
+        enclosing == "class"
+        and statement.paren_depth == 0
+        and statement.has_paren
+        and not statement.words & CONTROL_KEYWORDS
+    ):
+        return "function"
+    return "block"
+
+
+def scan_ts_functions(lines: list[str]) -> Iterator[tuple[int, int, int]]:
+    """
+    Yield `(start, body, end)` line numbers of every outermost function in
+    TypeScript/JavaScript source: `function` declarations and expressions,
+    arrow functions with a block body and class methods. `start` is the first
+    line of the statement (incl. `export`, excl. decorators on their own line),
+    `body` the line of the opening brace and `end` the line of the closing brace.
+
+    The source is lexed once, character by character, so braces inside strings,
+    template literals, comments and regex literals are not counted and the
+    cost is linear in the file size. Functions nested in another function are
+    part of it and not yielded separately.
+    """
+    stack = []  # (kind, statement of the enclosing level, line of the brace)
+    statement = _Statement()
+    function_start = None
+    in_function = False
+    mode = None  # None (code), "block_comment", "'", '"', "`" or "regex"
+    pending_boundary = False
+
+    for line_number, line in enumerate(lines):
+        i = 0
+        n = len(line)
+        while i < n:
+            char = line[i]
+
+            if mode == "block_comment":
+                end = line.find("*/", i)
+                if end < 0:
+                    break
+                mode = None
+                i = end + 2
+                continue
+            if mode in ("'", '"', "`"):
+                if char == "\\":
+                    i += 2
+                    continue
+                if char == mode:
+                    mode = None
+                    statement.last = "string"
+                elif mode == "`" and line.startswith("${", i):
+                    stack.append(("template", statement, line_number))
+                    statement = _Statement()
+                    mode = None
+                    i += 2
+                    continue
+                i += 1
+                continue
+            if mode == "regex":
+                if char == "\\":
+                    i += 2
+                    continue
+                if char == "[":
+                    in_class = True
+                    while i < n and in_class:
+                        i += 1
+                        if i < n and line[i] == "\\":
+                            i += 1
+                        elif i < n and line[i] == "]":
+                            in_class = False
+                elif char == "/":
+                    mode = None
+                    statement.last = "regex"
+                i += 1
+                continue
+
+            if char.isspace():
+                i += 1
+                continue
+            if line.startswith("//", i):
+                break
+            if line.startswith("/*", i):
+                mode = "block_comment"
+                i += 2
+                continue
+
+            # first token after a newline that ended the previous statement
+            if pending_boundary:
+                pending_boundary = False
+                if char not in ".?)]":
+                    statement = _Statement()
+            if statement.start is None:
+                statement.start = line_number
+
+            if char.isalnum() or char in "_$":
+                j = i + 1
+                while j < n and (line[j].isalnum() or line[j] in "_$"):
+                    j += 1
+                word = line[i:j]
+                if statement.first is None and word not in MODIFIERS:
+                    statement.first = word
+                statement.words.add(word)
+                statement.last = word
+                i = j
+                continue
+            if char in "'\"`":
+                mode = char
+            elif line.startswith("</", i):
+                # JSX closing tag (`</span>`, `</>`), not `<` followed by a regex
+                end = line.find(">", i + 2)
+                statement.last = ">"
+                i = end + 1 if end >= 0 else n
+                continue
+            elif line.startswith("/>", i):
+                # end of a self-closing JSX tag, e.g. `<Item key={i} />`
+                statement.last = ">"
+                i += 2
+                continue
+            elif char == "/":
+                if statement.last is None or statement.last in REGEX_PRECEDERS:
+                    mode = "regex"
+                else:
+                    statement.last = "/"
+            elif line.startswith("=>", i):
+                statement.last = "=>"
+                i += 2
+                continue
+            elif char in "([":
+                statement.paren_depth += 1
+                statement.has_paren = True
+                statement.last = char
+            elif char in ")]":
+                statement.paren_depth = max(0, statement.paren_depth - 1)
+                statement.last = char
+            elif char == ":" and statement.paren_depth == 0 and statement.last == ")":
+                # return type annotation of a function or method
+                statement.annotation = True
+                statement.last = char
+            elif char in "<>" and statement.annotation:
+                statement.angle_depth += 1 if char == "<" else -1
+                statement.angle_depth = max(0, statement.angle_depth)
+                statement.last = char
+            elif char == ";":
+                if statement.paren_depth == 0:
+                    statement = _Statement()
+                else:
+                    statement.last = char
+            elif char == "{":
+                if in_function:
+                    kind = "block"
+                else:
+                    kind = _brace_kind(statement, stack[-1][0] if stack else None)
+                if kind == "function":
+                    function_start = statement.start
+                    in_function = True
+                stack.append((kind, statement, line_number))
+                statement = _Statement()
+            elif char == "}":
+                if not stack:
+                    statement = _Statement()
+                    i += 1
+                    continue
+                kind, outer, opened_at = stack.pop()
+                if kind == "function":
+                    in_function = False
+                    yield function_start, opened_at, line_number
+                if kind == "template":
+                    statement = outer
+                    mode = "`"
+                elif kind == "annotation":
+                    # the annotation goes on, e.g. to the function body
+                    statement = outer
+                    statement.last = "}"
+                elif outer.paren_depth > 0:
+                    # e.g. the body of a callback argument: the call continues
+                    statement = outer
+                    statement.last = "}"
+                else:
+                    statement = _Statement()
+            else:
+                statement.last = char
+            i += 1
+
+        # plain strings and regexes cannot span lines (unterminated ones, e.g.
+        # apostrophes in JSX text, only affect their own line)
+        if mode in ("'", '"', "regex"):
+            mode = None
+        if (
+            mode is None
+            and statement.start is not None
+            and statement.paren_depth == 0
+            and statement.last not in CONTINUATIONS
+        ):
+            pending_boundary = True
@@ -0,0 +1,32 @@
+import os
+
+from transformers import AutoTokenizer
+
+from helpers.dedup import deduplicate_jsonl
+from helpers.token_dataset import build_token_dataset
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+
+
+if __name__ == "__main__":
+    model_path = os.path.join(current_path, "..", "models", "starcoder_3b_local")
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+    data_dir = os.path.join(current_path, "..", "data")
+    train_file = os.path.join(data_dir, "training", "train.jsonl")
+    dedup_file = os.path.join(data_dir, "training", "train.dedup.jsonl")
+    eval_file = os.path.join(data_dir, "evaluation", "evaluation.jsonl")
+
+    # same filtering as finetune.py: no near-duplicates, no evaluation overlap
+    deduplicate_jsonl(train_file, dedup_file, eval_file)
+    build_token_dataset(
+        dedup_file,
+        os.path.join(data_dir, "training", "train_tokens"),
+        tokenizer,
+    )
+    build_token_dataset(
+        eval_file,
+        os.path.join(data_dir, "evaluation", "evaluation_tokens"),
+        tokenizer,
+        separator="__###__",
+    )
@@ -1,12 +1,22 @@
 import os
-import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
-from tqdm import tqdm
 import json
 import random
+from tqdm import tqdm
 
 from helpers.load_model import load_model
-
+from helpers.completion_engine import CompletionEngine
+from helpers.prefix_cache import iter_prefix_cached
+from helpers.sharded_inference import iter_sharded_completions
+from helpers.token_dataset import TokenDataset
+from helpers.convert_data import ResumableJsonlWriter, iter_jsonl_lines, prompt_id
+from helpers.speculative import NgramIndex, SpeculativeDecoder
+from helpers.prompt_builder import PromptBuilder
+from helpers.prediction_cache import (
+    PredictionCache,
+    DEFAULT_GENERATION_PARAMS,
+    model_hash,
+)
 
 current_path = os.path.dirname(os.path.abspath(__file__))
 
@@ -16,54 +26,63 @@ def run_model(
     tokenizer: AutoTokenizer,
     prompt: str,
     max_length: int = 20,
+    speculative: bool = False,
+    repo_index: NgramIndex = None,
+    max_prompt_tokens: int = None,
 ) -> str:
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
-
-    newline_id = tokenizer.encode("\n", add_special_tokens=False)[0]
-    tokenizer.pad_token = "\n"
-    tokenizer.eos_token = "\n"
-
-    inputs = tokenizer(prompt, return_tensors="pt", padding=True, truncation=True)
-    inputs = {key: value.to(device) for key, value in inputs.items()}
-
-    outputs = model.generate(
-        inputs["input_ids"],
-        attention_mask=inputs["attention_mask"],
-        max_new_tokens=max_length,
-        num_return_sequences=1,
-        do_sample=False,
-        temperature=0.7,
-        pad_token_id=newline_id,
-        eos_token_id=newline_id,
-    )
-    full_generated = tokenizer.decode(outputs[0], skip_special_tokens=True).strip()
+    """
+    Greedy single-line completion of `prompt`. With `speculative`, drafts from
+    the prompt and `repo_index` (see `build_repo_index`) are verified in one
+    forward pass each; the output is the same as without. With
+    `max_prompt_tokens`, the prompt is first shortened by a `PromptBuilder`.
+    """
+    if max_prompt_tokens:
+        prompt = PromptBuilder(tokenizer, max_prompt_tokens).build(prompt)
+    if speculative:
+        decoder = SpeculativeDecoder(
+            model, tokenizer, repo_index, max_new_tokens=max_length
+        )
+        return decoder.complete(prompt)
+    engine = CompletionEngine(model, tokenizer, max_new_tokens=max_length)
+    return engine.complete(prompt)
 
-    # take first new line after prompt, or full output if no \n
-    generated_after_prompt = full_generated[len(prompt) :].strip()
-    return (
-        generated_after_prompt.split("\n")[0].strip() if generated_after_prompt else ""
-    )
 
+def run_model_batch(
+    model: AutoModelForCausalLM,
+    tokenizer: AutoTokenizer,
+    prompts: list[str],
+    max_length: int = 20,
+    batch_size: int = None,
+    token_budget: int = None,
+) -> list[str]:
+    """
+    Batched version of `run_model`: prompts are bucketed by token length, left-padded
+    and completed with one `model.generate` call per bucket. Outputs are returned in
+    the order of `prompts`.
+    """
+    engine = CompletionEngine(model, tokenizer, max_new_tokens=max_length)
+    return engine.complete_many(prompts, batch_size, token_budget)
 
-def generate_completion_outputs(
-    inputs_path: str,
-    output_path: str,
-    model,
-    tokenizer,
-    separator="__###__",
-    subset_size=None,
-):
-    if not os.path.exists(inputs_path):
-        raise FileNotFoundError(f"File not found: {inputs_path}")
 
-    results = []
-    with open(inputs_path, "r", encoding="utf-8") as f:
-        eval_lines = f.readlines()
+def load_eval_entries(
+    inputs_path: str,
+    separator: str = "__###__",
+    subset_size: int = None,
+    seed: int = 42,
+) -> list[tuple[str, str]]:
+    """
+    (prompt, target) pairs of every `separator`-split entry in `inputs_path` (or
+    its `JsonlSnippetWriter` shards), or of a random `subset_size` of them drawn
+    with `seed` (so a resumed run gets the same subset).
+    """
+    eval_lines = list(iter_jsonl_lines(inputs_path))
     if subset_size:
-        eval_lines = random.sample(eval_lines, min(subset_size, len(eval_lines)))
+        eval_lines = random.Random(seed).sample(
+            eval_lines, min(subset_size, len(eval_lines))
+        )
 
-    for line in tqdm(eval_lines, desc="Generating outputs", total=len(eval_lines)):
+    entries = []
+    for line in eval_lines:
         try:
             entry = json.loads(line.strip())
             if "text" not in entry:
@@ -72,28 +91,228 @@ def generate_completion_outputs(
             if separator not in text:
                 continue
             input_text, target = text.split(separator)
-            input_text = input_text.strip()
-            target = target.strip()
-
-            output = run_model(model, tokenizer, input_text)
-            results.append({"input": input_text, "output": output, "target": target})
+            entries.append((input_text.strip(), target.strip()))
 
         except (json.JSONDecodeError, ValueError):
             print(f"Error processing line: {line.strip()}")
             continue
+    return entries
+
+
+def load_token_entries(
+    token_dataset: str, tokenizer, subset_size: int = None, seed: int = 42
+) -> tuple[list[tuple[str, str]], list]:
+    """
+    (prompt, target) pairs and prompt token ids from a `TokenDataset`, subset
+    like in `load_eval_entries`.
+    """
+    tokens = TokenDataset(token_dataset, tokenizer)
+    indices = range(len(tokens))
+    if subset_size:
+        indices = random.Random(seed).sample(indices, min(subset_size, len(tokens)))
+    prompt_ids = [tokens.prompt_ids(i) for i in indices]
+    entries = [
+        (tokenizer.decode(ids), tokenizer.decode(tokens.target_ids(i)))
+        for i, ids in zip(indices, prompt_ids)
+    ]
+    return entries, prompt_ids
+
+
+def generate_completion_outputs(
+    inputs_path: str,
+    output_path: str,
+    model,
+    tokenizer,
+    separator="__###__",
+    subset_size=None,
+    seed: int = 42,
+    batch_size: int = 1,
+    token_budget: int = None,
+    prefix_cache: bool = False,
+    token_dataset: str = None,
+    resume: bool = True,
+    fsync_every: int = 32,
+    num_workers: int = 1,
+    threads_per_worker: int = None,
+    prediction_cache: str = None,
+    speculative: bool = False,
+    repo_index: NgramIndex = None,
+    max_prompt_tokens: int = None,
+) -> int:
+    """
+    Generate completions for every `separator`-split entry in `inputs_path` (or a
+    `subset_size` subset drawn with `seed`).
+    Each result is appended to the JSONL `output_path` as soon as it is produced
+    (fsynced every `fsync_every` results). With `resume`, snippets whose prompt id
+    is already in `output_path` are skipped, so a crashed run can be restarted;
+    rows record a hash of the model weights and a file written by another model
+    or adapter is not resumed (`ValueError`).
+    With `batch_size` > 1 or a `token_budget` (max padded tokens per batch),
+    prompts are length-bucketed and generated in batches by a `CompletionEngine`.
+    With `prefix_cache`, prompts sharing a prefix (e.g. line-by-line evaluation
+    snippets) reuse its `past_key_values` via `run_model_prefix_cached`.
+    With `token_dataset` (a prefix written by `build_token_dataset`), prompts are
+    read as token ids from the memory-mapped file and `inputs_path` is ignored.
+    With `num_workers` > 1, the snippets are split across that many CPU worker
+    processes sharing the model weights (see `iter_sharded_completions`); results
+    are written in the order they finish, rows are matched by their "id".
+    With `prediction_cache` (path of a `PredictionCache` database), completions of
+    the same weights, prompt tokens and generation parameters are reused from
+    earlier runs and only cache misses are generated.
+    With `speculative`, prompts are completed one by one with n-gram speculative
+    decoding (drafts from the prompt and `repo_index`), which gives the same
+    outputs in fewer forward passes on repetitive code.
+    With `max_prompt_tokens`, every prompt is assembled by a `PromptBuilder`
+    within that many tokens (code closest to the cursor plus the most relevant
+    imports) and the realized prompt lengths are reported.
+    Raises `ValueError` for combinations that cannot be honoured together
+    (`speculative` with `prefix_cache` or `num_workers` > 1, batching with
+    `speculative` or `prefix_cache`).
+    Returns the number of results written in this run.
+    """
+    batched = (batch_size or 1) > 1 or token_budget is not None
+    if speculative and (prefix_cache or num_workers > 1):
+        raise ValueError(
+            "speculative cannot be combined with prefix_cache or num_workers > 1"
+        )
+    if batched and (speculative or prefix_cache):
+        raise ValueError(
+            "batch_size/token_budget cannot be combined with speculative or prefix_cache"
+        )
+
+    prompt_ids = None
+    if token_dataset:
+        entries, prompt_ids = load_token_entries(
+            token_dataset, tokenizer, subset_size, seed
+        )
+    else:
+        entries = load_eval_entries(inputs_path, separator, subset_size, seed)
+
+    # rows of another model (e.g. a retrained adapter) must not be resumed
+    with ResumableJsonlWriter(
+        output_path, resume, fsync_every, model_hash(model)
+    ) as writer:
+        pending = [
+            i
+            for i, (input_text, _) in enumerate(entries)
+            if prompt_id(input_text) not in writer.completed
+        ]
+        if len(pending) < len(entries):
+            print(
+                f"Resuming: {len(entries) - len(pending)}/{len(entries)} snippets already done"
+            )
+
+        model_inputs = {i: entries[i][0] for i in pending}
+        if max_prompt_tokens and pending:
+            builder = PromptBuilder(tokenizer, max_prompt_tokens)
+            model_inputs = {i: builder.build(text) for i, text in model_inputs.items()}
+            builder.report()
+            prompt_ids = None
+
+        cache, keys = None, {}
+        if prediction_cache and pending:
+            cache = PredictionCache(prediction_cache, commit_every=fsync_every)
+        try:
+            if cache is not None:
+                weights_hash = cache.model_hash(model)
+                if prompt_ids is None:
+                    pending_ids = tokenizer(
+                        [model_inputs[i] for i in pending], truncation=True
+                    )["input_ids"]
+                else:
+                    pending_ids = [prompt_ids[i] for i in pending]
+                misses = []
+                for i, ids in zip(pending, pending_ids):
+                    key = cache.key(weights_hash, ids, DEFAULT_GENERATION_PARAMS)
+                    output = cache.get(key)
+                    if output is None:
+                        keys[i] = key
+                        misses.append(i)
+                        continue
+                    input_text, target = entries[i]
+                    writer.write(
+                        {
+                            "id": prompt_id(input_text),
+                            "input": input_text,
+                            "output": output,
+                            "target": target,
+                        }
+                    )
+                pending = misses
+
+            prompts = [model_inputs[i] for i in pending]
+            if not pending:
+                outputs = []
+            elif num_workers > 1:
+                outputs = iter_sharded_completions(
+                    model,
+                    tokenizer,
+                    prompts,
+                    None if prompt_ids is None else [prompt_ids[i] for i in pending],
+                    num_workers=num_workers,
+                    threads_per_worker=threads_per_worker,
+                    batch_size=batch_size,
+                    token_budget=token_budget,
+                    prefix_cache=prefix_cache,
+                )
+            elif prefix_cache:
+                outputs = iter_prefix_cached(model, tokenizer, prompts)
+            elif speculative:
+                decoder = SpeculativeDecoder(model, tokenizer, repo_index)
+                if prompt_ids is None:
+                    pending_ids = tokenizer(prompts, truncation=True)["input_ids"]
+                else:
+                    pending_ids = [prompt_ids[i] for i in pending]
+                outputs = (
+                    (j, decoder.complete_ids(ids))
+                    for j, ids in enumerate(
+                        tqdm(pending_ids, desc="Generating outputs")
+                    )
+                )
+            else:
+                engine = CompletionEngine(model, tokenizer)
+                if prompt_ids is None:
+                    pending_ids = engine.encode(prompts)
+                else:
+                    pending_ids = [prompt_ids[i] for i in pending]
+                outputs = engine.iter_complete_ids(
+                    pending_ids, batch_size, token_budget
+                )
+
+            for j, output in outputs:
+                input_text, target = entries[pending[j]]
+                if cache is not None:
+                    cache.put(keys[pending[j]], output)
+                writer.write(
+                    {
+                        "id": prompt_id(input_text),
+                        "input": input_text,
+                        "output": output,
+                        "target": target,
+                    }
+                )
+        finally:
+            # commits what was generated, also when the run crashes
+            if cache is not None:
+                cache.close()
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2)
     print(f"Eval results saved to {output_path}")
-    return results
+    return writer.count
 
 
 if __name__ == "__main__":
-    input_path = os.path.join(current_path, "..", "data", "evaluation", "snippets")
+    input_path = os.path.join(
+        current_path, "..", "data", "evaluation", "evaluation.jsonl"
+    )
     model = "starcoder_3b_local"
     model_path = os.path.join(current_path, "..", "models", model)
     output_path = os.path.join(
-        current_path, "..", "data", "evaluation", "finetuned_predictions.json"
+        current_path, "..", "data", "evaluation", "finetuned_predictions.jsonl"
+    )
+    cache_path = os.path.join(
+        current_path, "..", "data", "evaluation", "prediction_cache.sqlite"
     )
     model, tokenizer = load_model(model_path)
-    generate_completion_outputs(input_path, output_path, model, tokenizer)
+    generate_completion_outputs(
+        input_path, output_path, model, tokenizer, prediction_cache=cache_path
+    )
@@ -0,0 +1,143 @@
+import os
+import json
+import asyncio
+
+from helpers.load_model import load_model
+from helpers.continuous_batching import ContinuousBatcher, QueueFullError
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+async def read_request(reader: asyncio.StreamReader) -> tuple[str, str, bytes]:
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) < 2:
+        raise ValueError("Malformed request line")
+    method, path = request_line[0], request_line[1]
+    content_length = 0
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-length":
+            content_length = int(value)
+    body = await reader.readexactly(content_length) if content_length else b""
+    return method, path, body
+
+
+def write_response(writer: asyncio.StreamWriter, status: int, payload: dict):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n".encode("latin-1") + body
+    )
+
+
+async def complete_unless_disconnected(
+    batcher: ContinuousBatcher, reader: asyncio.StreamReader, prompt: str, timeout
+) -> str:
+    """Run the completion, cancelling it if the client closes the connection."""
+    completion = asyncio.ensure_future(batcher.submit(prompt, timeout))
+    disconnect = asyncio.ensure_future(reader.read())
+    done, _ = await asyncio.wait(
+        [completion, disconnect], return_when=asyncio.FIRST_COMPLETED
+    )
+    if completion not in done:
+        completion.cancel()
+        raise ConnectionResetError("Client disconnected")
+    disconnect.cancel()
+    return completion.result()
+
+
+def make_handler(batcher: ContinuousBatcher, default_timeout: float = None):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, body = await read_request(reader)
+            if method == "GET" and path == "/health":
+                write_response(
+                    writer,
+                    200,
+                    {"active": len(batcher.active), "queued": len(batcher.waiting)},
+                )
+            elif method == "POST" and path == "/complete":
+                request = json.loads(body or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("Request body must be a JSON object")
+                if not isinstance(request.get("prompt"), str):
+                    raise ValueError("Missing prompt")
+                completion = await complete_unless_disconnected(
+                    batcher,
+                    reader,
+                    request["prompt"],
+                    request.get("timeout", default_timeout),
+                )
+                write_response(writer, 200, {"completion": completion})
+            else:
+                write_response(writer, 404, {"error": f"Unknown route {path}"})
+        except (ValueError, json.JSONDecodeError, asyncio.IncompleteReadError) as e:
+            write_response(writer, 400, {"error": str(e)})
+        except QueueFullError as e:
+            write_response(writer, 503, {"error": str(e)})
+        except asyncio.TimeoutError:
+            write_response(writer, 504, {"error": "Deadline exceeded"})
+        except ConnectionResetError:
+            pass
+        except Exception as e:
+            write_response(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    return handle
+
+
+async def serve(
+    model,
+    tokenizer,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    max_batch_size: int = 8,
+    max_queue: int = 64,
+    default_timeout: float = 10.0,
+):
+    """
+    Serve single-line completions over HTTP:
+      - `POST /complete` with `{"prompt": ..., "timeout": seconds}` returns
+        `{"completion": ...}`, or 400 for a malformed request (e.g. an empty
+        prompt), 504 when the deadline passes and 503 when the queue is full
+      - `GET /health` returns the number of running and queued requests
+    Requests are decoded together by a `ContinuousBatcher`; a client closing
+    its connection cancels its request.
+    """
+    batcher = ContinuousBatcher(model, tokenizer, max_batch_size, max_queue)
+    scheduler = asyncio.create_task(batcher.run())
+    server = await asyncio.start_server(
+        make_handler(batcher, default_timeout), host, port
+    )
+    print(f"Serving completions on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        scheduler.cancel()
+
+
+if __name__ == "__main__":
+    model_path = os.path.join(current_path, "..", "models", "starcoder_3b_local")
+    model, tokenizer = load_model(model_path)
+    asyncio.run(serve(model, tokenizer))
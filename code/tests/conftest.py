@@ -0,0 +1,5 @@
+import os
+import sys
+
+# scripts import helpers as `from helpers.x import ...` from inside code/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
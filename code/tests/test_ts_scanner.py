@@ -0,0 +1,136 @@
+from helpers.ts_scanner import scan_ts_functions
+
+
+def scan(source: str) -> list[tuple[int, int, int]]:
+    return list(scan_ts_functions(source.splitlines(keepends=True)))
+
+
+def test_function_declaration_and_arrow():
+    source = """\
+import { x } from './x'
+
+export function add(a: number, b: number) {
+  return a + b
+}
+
+const double = (n: number) => {
+  return n * 2
+}
+"""
+    assert scan(source) == [(2, 2, 4), (6, 6, 8)]
+
+
+def test_class_methods():
+    source = """\
+class Counter {
+  count = 0
+  increment() {
+    if (this.count < 10) {
+      this.count++
+    }
+  }
+}
+"""
+    assert scan(source) == [(2, 2, 6)]
+
+
+def test_tsx_closing_tags():
+    source = """\
+export function Header({ title, isOpen }: Props) {
+  return <div>{isOpen && <span>{title}</span>}</div>
+}
+
+export const List = ({ items }: ListProps) => {
+  return <ul>{items.map((i) => <li>{i}</li>)}</ul>
+}
+
+const Empty = () => {
+  return <>{null}</>
+}
+"""
+    assert scan(source) == [(0, 0, 2), (4, 4, 6), (8, 8, 10)]
+
+
+def test_template_literal_substitutions():
+    source = """\
+function greet(user: User) {
+  const text = `{ hello ${user.name} } ${user.items.map((i) => { return i })}`
+  return text
+}
+
+function after() {
+  return 1
+}
+"""
+    assert scan(source) == [(0, 0, 3), (5, 5, 7)]
+
+
+def test_regex_and_division():
+    source = """\
+function ratio(a: number, b: number) {
+  const half = a / 2 / b
+  const braces = /[{}]+/g
+  const slash = text.replace(/\\/{/g, '')
+  return (a + b) / 2
+}
+
+function next() {
+  return 1
+}
+"""
+    assert scan(source) == [(0, 0, 5), (7, 7, 9)]
+
+
+def test_braces_in_strings_and_comments():
+    source = """\
+function braces() {
+  const open = '{'
+  // }
+  /* } */
+  return "}"
+}
+"""
+    assert scan(source) == [(0, 0, 5)]
+
+
+def test_tsx_self_closing_tags_after_attributes():
+    source = """\
+export function List({ xs }: Props) {
+  return <ul>{xs.map((i) => <Item key={i} />)}</ul>
+}
+
+export function Dialog({ open, close }: DialogProps) {
+  return <div>{open && <Modal onClose={close} />}</div>
+}
+
+export function Empty() {
+  return <br />
+}
+"""
+    assert scan(source) == [(0, 0, 2), (4, 4, 6), (8, 8, 10)]
+
+
+def test_object_types_in_return_annotations():
+    source = """\
+export async function load(id: string): Promise<{ items: Item[] }> {
+  const res = await fetch(`/api/${id}`)
+  return res.json()
+}
+
+function pair(a: number): { a: number } | null {
+  return { a }
+}
+
+const fetchAll = async (ids: string[]): Promise<Array<{ id: string }>> => {
+  return ids.map((id) => ({ id }))
+}
+
+class Store {
+  get(key: string): { value: string } {
+    return { value: key }
+  }
+}
+
+const max = count(x) ? limit : { size: 1 }
+"""
+    assert scan(source) == [(0, 0, 3), (5, 5, 7), (9, 9, 11), (14, 14, 16)]